@@ -0,0 +1,102 @@
+import json
+import threading
+from typing import Any, Dict, Optional
+from backend.cache import LRUCache
+from backend.search import normalize, stem
+from backend.config import log, cfg
+
+
+def normalize_question(text: str) -> str:
+    """Case, punctuation and inflection-insensitive form of a question."""
+    return " ".join(stem(w) for w in normalize(text).split())
+
+
+class AnswerCache:
+    """
+    Final answers (text, insights, chart) of first questions in a conversation,
+    keyed by the normalized question and the data version. With
+    ANSWER_CACHE_EMBED_MODEL set, a miss falls back to the most similar cached
+    question by sentence-embedding cosine similarity once `load_model()` has run.
+    get/put then encode the question, so async callers run them in a thread.
+    """
+
+    def __init__(self, max_mb: int = None, ttl_hours: float = None, embed_model: str = None):
+        max_mb = cfg.ANSWER_CACHE_MB if max_mb is None else max_mb
+        ttl_hours = cfg.ANSWER_CACHE_TTL_HOURS if ttl_hours is None else ttl_hours
+        self.cache = LRUCache(
+            max_mb * 1024 * 1024,
+            sizeof=lambda v: len(json.dumps(v, ensure_ascii=False)),
+            ttl=ttl_hours * 3600 if ttl_hours else None,
+        )
+        self.model_name = cfg.ANSWER_CACHE_EMBED_MODEL if embed_model is None else embed_model
+        self._model = None
+        self._vectors: Dict[tuple, Any] = {}
+        self._lock = threading.Lock()
+
+    @property
+    def enabled(self) -> bool:
+        return self.cache.max_bytes > 0
+
+    def load_model(self):
+        """Load the embedding model; called once at startup, exact keys only until then."""
+        if not self.model_name or self._model is not None:
+            return
+        try:
+            from sentence_transformers import SentenceTransformer
+            self._model = SentenceTransformer(self.model_name)
+            log("AnswerCache", f"Embedding model '{self.model_name}' loaded", "G")
+        except Exception as e:
+            log("AnswerCache", f"Embedding model unavailable ({e}), using exact keys only", "Y")
+            self.model_name = ""
+
+    def _embed(self, text: str):
+        if self._model is None:
+            return None
+        return self._model.encode(text, normalize_embeddings=True)
+
+    def _similar(self, vector, data_version: int) -> Optional[tuple]:
+        best, best_score = None, cfg.ANSWER_CACHE_SIMILARITY
+        with self._lock:
+            for key, vec in list(self._vectors.items()):
+                if key[1] != data_version:
+                    continue
+                score = float(vec @ vector)
+                if score >= best_score:
+                    best, best_score = key, score
+        return best
+
+    def get(self, question: str, data_version: int) -> Optional[Dict[str, Any]]:
+        if not self.enabled:
+            return None
+        key = (normalize_question(question), data_version)
+        hit = self.cache.get(key)
+        if hit is None and self.model_name:
+            vector = self._embed(question)
+            similar = self._similar(vector, data_version) if vector is not None else None
+            if similar is not None:
+                hit = self.cache.get(similar)
+                if hit is None:
+                    with self._lock:
+                        self._vectors.pop(similar, None)
+        return hit
+
+    def put(self, question: str, data_version: int, entry: Dict[str, Any]):
+        if not self.enabled:
+            return
+        key = (normalize_question(question), data_version)
+        self.cache.put(key, entry)
+        vector = self._embed(question) if self.model_name else None
+        if vector is not None:
+            with self._lock:
+                self._vectors[key] = vector
+                # Drop vectors of entries the LRU has already evicted
+                if len(self._vectors) > 2 * max(len(self.cache), 1):
+                    self._vectors = {k: v for k, v in self._vectors.items() if k in self.cache}
+
+    def clear(self):
+        self.cache.clear()
+        with self._lock:
+            self._vectors.clear()
+
+    def stats(self) -> Dict[str, Any]:
+        return self.cache.stats()
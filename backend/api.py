@@ -2,17 +2,36 @@ import json
 import asyncio
 import time
 import uuid
+from contextlib import asynccontextmanager
 from fastapi import FastAPI, HTTPException
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import StreamingResponse
+from fastapi.responses import StreamingResponse, PlainTextResponse, JSONResponse
 from pydantic import BaseModel
-from typing import Optional
-from langchain_core.messages import HumanMessage, AIMessage
+from typing import Any, Dict, List, Optional
+from langchain_core.messages import HumanMessage, AIMessage, AIMessageChunk
 
 from backend.graph import medical_graph
+from backend.answer_cache import AnswerCache
+from backend.checkpoint import checkpointer_stats
+from backend import metrics
 from backend.config import cfg, log
 
-app = FastAPI(title="Medical Insight API")
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Accept connections right away; tables become usable as they load (see /ready)
+    async def start():
+        try:
+            await asyncio.to_thread(medical_graph.start)
+            await asyncio.to_thread(answer_cache.load_model)
+        except Exception as e:
+            log("API", f"Startup failed: {e}", "R")
+
+    app.state.startup = asyncio.create_task(start())
+    yield
+    medical_graph.sandbox.close()
+
+
+app = FastAPI(title="Medical Insight API", lifespan=lifespan)
 
 app.add_middleware(
     CORSMiddleware,
@@ -22,10 +41,19 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+answer_cache = AnswerCache()
+
 
 class QueryRequest(BaseModel):
     query: str
     thread_id: Optional[str] = None
+    stream_tokens: Optional[bool] = None
+    no_cache: bool = False
+
+
+class BatchRequest(BaseModel):
+    questions: List[str]
+    concurrency: Optional[int] = None   # capped at BATCH_CONCURRENCY
 
 
 class ConversationHistoryRequest(BaseModel):
@@ -55,8 +83,131 @@ def get_chart_title(viz) -> str:
     return ''
 
 
-async def graph_event_stream(query: str, thread_id: str = None):
+def _partial_json_string(buf: str, key: str) -> str:
+    """Decoded prefix of a string value in incomplete JSON (e.g. streamed tool args)."""
+    start = buf.find(f'"{key}"')
+    if start < 0:
+        return ""
+    colon = buf.find(":", start + len(key) + 2)
+    quote = buf.find('"', colon + 1) if colon >= 0 else -1
+    if quote < 0:
+        return ""
+    i, end = quote + 1, len(buf)
+    while i < end:
+        if buf[i] == "\\":
+            if i + 1 >= end or (buf[i + 1] == "u" and i + 6 > end):
+                break
+            i += 6 if buf[i + 1] == "u" else 2
+            continue
+        if buf[i] == '"':
+            break
+        i += 1
+    try:
+        return json.loads(f'"{buf[quote + 1:i]}"')
+    except ValueError:
+        return ""
+
+
+class DeltaExtractor:
+    """Turns streamed agent message chunks into incremental thought/answer text."""
+
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        self.run_id = None
+        # Text and tool-call arguments streamed so far, per model run (chunk id)
+        self.runs: Dict[str, Dict[str, Any]] = {}
+        self.failed = set()
+        self.answer_sent = 0
+
+    def fallback(self):
+        """The followed run failed; follow the next other run, replaying what it streamed so far."""
+        if self.run_id is not None:
+            self.failed.add(self.run_id)
+        self.run_id = None
+
+    def winner(self, run_id: str):
+        """The model call returned run `run_id`; if another run was followed, switch to it."""
+        if run_id == self.run_id or run_id not in self.runs:
+            return
+        self.fallback()
+        self.run_id = run_id
+        yield from self._switch(self.runs[run_id])
+
+    def _switch(self, run: Dict[str, Any]):
+        # Text of the abandoned run is void; start over with this run's text so far
+        yield "reset", ""
+        self.answer_sent = 0
+        yield from self._emit(run, run["text"])
+
+    def _emit(self, run: Dict[str, Any], content: str):
+        if content:
+            yield "thought", content
+        for idx, name in run["tool_names"].items():
+            if name == "final_answer":
+                answer = _partial_json_string(run["tool_args"][idx], "answer")
+                if len(answer) > self.answer_sent:
+                    yield "answer", answer[self.answer_sent:]
+                    self.answer_sent = len(answer)
+
+    def feed(self, chunk: AIMessageChunk):
+        run = self.runs.setdefault(chunk.id, {"text": "", "tool_args": {}, "tool_names": {}})
+        content = chunk.content
+        if isinstance(content, list):
+            content = "".join(c.get("text", "") if isinstance(c, dict) else str(c) for c in content)
+        run["text"] += content or ""
+        for tc in chunk.tool_call_chunks or []:
+            idx = tc.get("index") or 0
+            if tc.get("name"):
+                run["tool_names"][idx] = tc["name"]
+            run["tool_args"][idx] = run["tool_args"].get(idx, "") + (tc.get("args") or "")
+
+        # With hedging two model runs may stream at once; follow the first one
+        if self.run_id is None and chunk.id not in self.failed:
+            self.run_id = chunk.id
+            if self.failed:
+                yield from self._switch(run)
+                return
+        if chunk.id == self.run_id:
+            yield from self._emit(run, content)
+
+
+async def replay_cached(query: str, hit: dict):
+    """Serve a cached answer as a new conversation seeded with the question and answer."""
+    thread_id = f"session_{uuid.uuid4()}"
+    log("API", f"Answer cache hit: {thread_id}", "G")
+    config = {"configurable": {"thread_id": thread_id}}
+    final = {"answer": hit["answer"], "insights": hit["insights"]}
+    await medical_graph.graph.aupdate_state(config, {
+        "messages": [HumanMessage(content=query), AIMessage(content=hit["answer"])],
+        "final_response": final,
+        "visualization_json": hit["visualization"],
+    }, as_node="agent")
+
+    viz_id = None
+    if hit["visualization"]:
+        viz_id = f"viz_{uuid.uuid4().hex[:8]}"
+        yield f"data: {json.dumps({'type': 'visualization', 'id': viz_id, 'data': hit['visualization']})}\n\n"
+    yield f"data: {json.dumps({'type': 'final', **final, 'visualization_id': viz_id, 'thread_id': thread_id, 'cached': True})}\n\n"
+
+
+async def graph_event_stream(query: str, thread_id: str = None, stream_tokens: bool = None, use_cache: bool = True):
     """Stream graph execution events."""
+    spans = metrics.start_request()
+    t_request = time.perf_counter()
+    # Follow-ups depend on the conversation, so only first questions are cached
+    use_cache = use_cache and not thread_id
+    data_version = medical_graph.db.data_version
+    if use_cache:
+        # Embedding the question is CPU-bound, keep it off the event loop
+        hit = await asyncio.to_thread(answer_cache.get, query, data_version)
+        if hit is not None:
+            async for chunk in replay_cached(query, hit):
+                yield chunk
+            metrics.record("request", time.perf_counter() - t_request, cached=True)
+            return
+
     if not thread_id:
         thread_id = f"session_{uuid.uuid4()}"
         log("API", f"New conversation: {thread_id}", "G")
@@ -72,30 +223,66 @@ async def graph_event_stream(query: str, thread_id: str = None):
     step_count = 0
     last_event_time = time.time()
     last_viz = None
+    viz_id = None
     final_sent = False
     last_text = ""
 
+    if stream_tokens is None:
+        stream_tokens = cfg.STREAM_TOKENS
+    modes = ["updates", "messages", "custom"] if stream_tokens else ["updates"]
+    deltas = DeltaExtractor()
+
     try:
-        async for event in medical_graph.graph.astream(inputs, stream_mode="updates", config=config):
+        async for mode, event in medical_graph.graph.astream(inputs, stream_mode=modes, config=config):
+            if mode == "messages":
+                chunk, meta = event
+                # Nothing streamed after the final answer belongs to it
+                if meta.get("langgraph_node") == "agent" and isinstance(chunk, AIMessageChunk) and not final_sent:
+                    for kind, text in deltas.feed(chunk):
+                        yield f"data: {json.dumps({'type': 'delta', 'kind': kind, 'text': text})}\n\n"
+                continue
+            if mode == "custom":
+                if event.get("event") == "llm_fallback":
+                    deltas.fallback()
+                elif event.get("event") == "llm_winner" and not final_sent:
+                    for kind, text in deltas.winner(event["id"]):
+                        yield f"data: {json.dumps({'type': 'delta', 'kind': kind, 'text': text})}\n\n"
+                continue
+
+            deltas.reset()
             now = time.time()
             duration = now - last_event_time
             last_event_time = now
 
-            for node_name, node_val in event.items():
+            def timed(payload: dict) -> dict:
+                # Stages finished since the previous event are attached to this one
+                done = metrics.drain(spans)
+                if done:
+                    payload["spans"] = done
+                return payload
+
+            # A node whose tools ran concurrently reports one update per tool call
+            updates = [(name, u) for name, val in event.items() for u in (val if isinstance(val, list) else [val])]
+            for node_name, node_val in updates:
                 # Handle visualization
                 if "visualization_json" in node_val:
                     viz = node_val["visualization_json"]
-                    if viz and viz != last_viz:
+                    if viz and viz is not last_viz:
                         last_viz = viz
-                        yield f"data: {json.dumps({'type': 'visualization', 'data': viz})}\n\n"
+                        viz_id = f"viz_{uuid.uuid4().hex[:8]}"
+                        with metrics.span("serialize"):
+                            payload = json.dumps({'type': 'visualization', 'id': viz_id, 'data': viz})
+                        yield f"data: {payload}\n\n"
 
                 # Handle final response
                 if "final_response" in node_val and node_val["final_response"]:
                     resp = node_val["final_response"]
                     answer = extract_answer(resp)
                     insights = resp.get('insights', []) if isinstance(resp, dict) else []
-                    yield f"data: {json.dumps({'type': 'final', 'answer': answer, 'insights': insights, 'visualization': last_viz, 'thread_id': thread_id})}\n\n"
+                    yield f"data: {json.dumps(timed({'type': 'final', 'answer': answer, 'insights': insights, 'visualization_id': viz_id, 'thread_id': thread_id}))}\n\n"
                     final_sent = True
+                    if use_cache:
+                        await asyncio.to_thread(answer_cache.put, query, data_version, {"answer": answer, "insights": insights, "visualization": last_viz})
 
                 # Handle messages
                 if "messages" in node_val:
@@ -105,16 +292,16 @@ async def graph_event_stream(query: str, thread_id: str = None):
                             if hasattr(msg, 'tool_calls') and msg.tool_calls:
                                 for tc in msg.tool_calls:
                                     if tc["name"] != "final_answer":
-                                        yield f"data: {json.dumps({'type': 'step', 'step': step_count, 'tool': tc['name'], 'duration': duration})}\n\n"
+                                        yield f"data: {json.dumps(timed({'type': 'step', 'step': step_count, 'tool': tc['name'], 'duration': duration}))}\n\n"
                             elif msg.content:
                                 content = msg.content
                                 if isinstance(content, list):
                                     content = " ".join(str(c.get('text', c)) if isinstance(c, dict) else str(c) for c in content)
                                 last_text = str(content)
-                                yield f"data: {json.dumps({'type': 'step', 'step': step_count, 'tool': 'thought', 'thought': last_text[:500], 'duration': duration})}\n\n"
+                                yield f"data: {json.dumps(timed({'type': 'step', 'step': step_count, 'tool': 'thought', 'thought': last_text[:500], 'duration': duration}))}\n\n"
                         elif hasattr(msg, 'content') and msg.content and msg.content != "Answer submitted.":
                             preview = str(msg.content)[:300] + "..." if len(str(msg.content)) > 300 else str(msg.content)
-                            yield f"data: {json.dumps({'type': 'tool_result', 'result': preview, 'duration': duration})}\n\n"
+                            yield f"data: {json.dumps(timed({'type': 'tool_result', 'result': preview, 'duration': duration}))}\n\n"
 
             await asyncio.sleep(0.01)
 
@@ -122,21 +309,42 @@ async def graph_event_stream(query: str, thread_id: str = None):
         if not final_sent:
             # Use last_text, or chart title, or default
             answer = last_text or get_chart_title(last_viz) or 'График построен'
-            yield f"data: {json.dumps({'type': 'final', 'answer': answer, 'insights': [], 'visualization': last_viz, 'thread_id': thread_id})}\n\n"
+            yield f"data: {json.dumps({'type': 'final', 'answer': answer, 'insights': [], 'visualization_id': viz_id, 'thread_id': thread_id})}\n\n"
 
     except Exception as e:
         log("API", f"Stream error: {e}", "R")
         yield f"data: {json.dumps({'type': 'error', 'message': str(e)})}\n\n"
+    finally:
+        metrics.record("request", time.perf_counter() - t_request, cached=False)
 
 
 @app.post("/chat/stream")
 async def chat_stream(req: QueryRequest):
+    if not medical_graph.models_ready:
+        raise HTTPException(status_code=503, detail="Service is starting, retry shortly")
     return StreamingResponse(
-        graph_event_stream(req.query, req.thread_id),
+        graph_event_stream(req.query, req.thread_id, req.stream_tokens, use_cache=not req.no_cache),
         media_type="text/event-stream"
     )
 
 
+@app.post("/chat/batch")
+async def chat_batch(req: BatchRequest):
+    """Answer independent questions concurrently; one NDJSON line per question, in completion order."""
+    if not medical_graph.models_ready:
+        raise HTTPException(status_code=503, detail="Service is starting, retry shortly")
+    if len(req.questions) > cfg.BATCH_MAX_QUESTIONS:
+        raise HTTPException(status_code=413, detail=f"At most {cfg.BATCH_MAX_QUESTIONS} questions per batch")
+    concurrency = min(req.concurrency or cfg.BATCH_CONCURRENCY, cfg.BATCH_CONCURRENCY)
+    log("API", f"Batch of {len(req.questions)} questions, concurrency {concurrency}", "G")
+
+    async def lines():
+        async for result in medical_graph.abatch(req.questions, max(concurrency, 1)):
+            yield json.dumps(result, ensure_ascii=False) + "\n"
+
+    return StreamingResponse(lines(), media_type="application/x-ndjson")
+
+
 @app.post("/chat/history")
 async def get_conversation_history(req: ConversationHistoryRequest):
     try:
@@ -159,13 +367,53 @@ async def get_conversation_history(req: ConversationHistoryRequest):
 
 @app.delete("/chat/history/{thread_id}")
 async def delete_conversation(thread_id: str):
+    try:
+        await medical_graph.checkpointer.adelete_thread(thread_id)
+    except Exception as e:
+        log("API", f"Delete error: {e}", "R")
+        raise HTTPException(status_code=500, detail=str(e))
     log("API", f"Deleted: {thread_id}", "Y")
     return {"status": "deleted", "thread_id": thread_id}
 
 
+@app.post("/data/refresh")
+async def refresh_data():
+    """Load new, changed and removed files in the data directory without a restart."""
+    try:
+        summary = await asyncio.to_thread(medical_graph.db.refresh)
+        # Re-profile changed tables now rather than in the next chat request
+        await asyncio.to_thread(medical_graph.catalog.tables)
+        return summary
+    except RuntimeError as e:
+        raise HTTPException(status_code=409, detail=str(e))
+
+
+def component_stats() -> dict:
+    return {
+        "checkpointer": checkpointer_stats(medical_graph.checkpointer),
+        "db": medical_graph.db.stats(),
+        "answer_cache": answer_cache.stats(),
+        "sandbox": medical_graph.sandbox.stats(),
+    }
+
+
 @app.get("/health")
 def health():
-    return {"status": "ok", "checkpointer": "memory"}
+    return {"status": "ok", **component_stats()}
+
+
+@app.get("/ready")
+def ready():
+    """200 once all tables are loaded and profiled, 503 before; per-table progress either way."""
+    state = {**medical_graph.db.readiness(), "models": medical_graph.models_ready,
+             "schema": medical_graph.catalog.profiled}
+    state["ready"] = state["ready"] and state["models"] and state["schema"]
+    return JSONResponse(state, status_code=200 if state["ready"] else 503)
+
+
+@app.get("/metrics")
+def prometheus_metrics():
+    return PlainTextResponse(metrics.render(component_stats()), media_type="text/plain; version=0.0.4")
 
 
 @app.get("/")
@@ -0,0 +1,143 @@
+import re
+import threading
+from typing import Dict, List, Optional, Any
+from backend.rollups import ROLLUP_PREFIX
+from backend.config import log, cfg
+
+WORD_RE = re.compile(r"[a-zA-Zа-яА-ЯёЁ0-9_]+")
+
+
+def _stems(text: str) -> set:
+    """Crude language-agnostic stems: lowercase words cut to 5 chars."""
+    words = WORD_RE.findall(text.lower().replace("ё", "е"))
+    return {w[:5] for w in words if len(w) >= 3}
+
+
+class SchemaCatalog:
+    """
+    Tables, columns and data profile of the database. A new data version only
+    re-profiles tables that changed since their last profile (see Database.table_versions).
+    """
+
+    def __init__(self, db):
+        self.db = db
+        self._version = None
+        self._tables: Dict[str, Dict[str, Any]] = {}
+        # data_version each table was profiled at
+        self._profiled: Dict[str, int] = {}
+        self._lock = threading.Lock()
+
+    @property
+    def profiled(self) -> bool:
+        """Whether the schema has been profiled at least once."""
+        return self._version is not None
+
+    def tables(self) -> Dict[str, Dict[str, Any]]:
+        if self._version != self.db.data_version:
+            # Concurrent conversations wait for one profile instead of each running it
+            with self._lock:
+                if self._version != self.db.data_version:
+                    self._build()
+        return self._tables
+
+    def _build(self):
+        version = self.db.data_version
+        tables, profiled = {}, {}
+        try:
+            names = [t[0] for t in self.db.fetchall("SHOW TABLES")]
+        except Exception as e:
+            log("Catalog", f"Could not list tables: {e}", "R")
+            names = []
+
+        for t in names:
+            if t in self._tables and self._profiled[t] >= self.db.table_versions.get(t, 0):
+                tables[t], profiled[t] = self._tables[t], self._profiled[t]
+                continue
+            try:
+                summary = self.db.fetchall(f"SUMMARIZE {t}")
+            except Exception as e:
+                log("Catalog", f"Could not profile '{t}': {e}", "Y")
+                continue
+
+            rows = summary[0][10] if summary else 0
+            cols = []
+            for c in summary:
+                name, ctype, approx_unique = c[0], c[1], c[4]
+                samples = []
+                if ctype == "VARCHAR" and approx_unique and approx_unique <= cfg.SCHEMA_SAMPLE_MAX_CARDINALITY:
+                    samples = [r[0] for r in self.db.fetchall(
+                        f'SELECT "{name}" FROM {t} WHERE "{name}" IS NOT NULL '
+                        f'GROUP BY 1 ORDER BY count(*) DESC LIMIT {cfg.SCHEMA_SAMPLE_VALUES}'
+                    )]
+                cols.append({"name": name, "type": ctype, "distinct": approx_unique, "samples": samples})
+
+            stems = _stems(t)
+            for c in cols:
+                stems |= _stems(c["name"]) | _stems(" ".join(map(str, c["samples"])))
+            tables[t] = {"rows": rows, "columns": cols, "stems": stems}
+            profiled[t] = version
+
+        fresh = sum(v == version for v in profiled.values())
+        self._tables, self._profiled = tables, profiled
+        self._version = version
+        log("Catalog", f"Profiled {fresh} of {len(tables)} tables (data v{version})", "G")
+
+    def _select(self, question: Optional[str]) -> List[str]:
+        tables = self.tables()
+        if not question:
+            return list(tables)[:cfg.SCHEMA_MAX_TABLES]
+
+        q = _stems(question)
+        scored = [(len(q & info["stems"]), name) for name, info in tables.items()]
+        hits = [name for score, name in sorted(scored, key=lambda x: -x[0]) if score > 0]
+        if not hits:
+            # Nothing matched (e.g. a short follow-up) - fall back to the full list
+            return list(tables)[:cfg.SCHEMA_MAX_TABLES]
+
+        # Tables sharing a column with a hit are its join partners (e.g. facts for a dictionary)
+        hit_cols = {c["name"] for name in hits for c in tables[name]["columns"]}
+        partners = [name for name, info in tables.items()
+                    if name not in hits and not name.startswith(ROLLUP_PREFIX)
+                    and hit_cols & {c["name"] for c in info["columns"]}]
+        return (hits + partners)[:cfg.SCHEMA_MAX_TABLES]
+
+    def _render_column(self, c: Dict[str, Any]) -> str:
+        out = f"{c['name']}:{c['type']}"
+        if c["samples"]:
+            out += " [" + ", ".join(repr(s) for s in c["samples"]) + "]"
+        elif c["distinct"]:
+            out += f" ~{c['distinct']} distinct"
+        return out
+
+    def render(self, question: Optional[str] = None) -> str:
+        """Schema text for the system prompt, pruned to tables relevant to the question."""
+        tables = self.tables()
+        if not tables:
+            return "No tables found."
+
+        q = _stems(question or "")
+        selected = self._select(question)
+        out = []
+        for name in selected:
+            info = tables[name]
+            cols = info["columns"]
+            if len(cols) > cfg.SCHEMA_MAX_COLUMNS:
+                # Keep question-relevant and key columns first
+                ranked = sorted(cols, key=lambda c: (
+                    not (_stems(c["name"]) & q),
+                    not c["name"].endswith(("_code", "_id", "date")),
+                ))
+                shown = ranked[:cfg.SCHEMA_MAX_COLUMNS]
+                col_str = ", ".join(self._render_column(c) for c in cols if c in shown)
+                col_str += f", ... +{len(cols) - len(shown)} more"
+            else:
+                col_str = ", ".join(self._render_column(c) for c in cols)
+            line = f"TABLE {name} rows={info['rows']} ({col_str})"
+            if name.startswith(ROLLUP_PREFIX):
+                line += f" -- pre-aggregated {name[len(ROLLUP_PREFIX):]}: count(*) = SUM(cnt)"
+            out.append(line)
+
+        omitted = [t for t in tables if t not in selected]
+        if omitted:
+            out.append(f"-- other tables: {', '.join(omitted)}")
+        return "\n".join(out)
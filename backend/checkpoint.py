@@ -0,0 +1,268 @@
+import os
+import time
+import random
+import sqlite3
+import asyncio
+import threading
+from typing import Any, AsyncIterator, Dict, Iterator, Optional, Sequence
+
+from langchain_core.runnables import RunnableConfig
+from langgraph.checkpoint.base import (
+    WRITES_IDX_MAP,
+    BaseCheckpointSaver,
+    ChannelVersions,
+    Checkpoint,
+    CheckpointMetadata,
+    CheckpointTuple,
+    get_checkpoint_id,
+    get_checkpoint_metadata,
+)
+from langgraph.checkpoint.memory import InMemorySaver
+from backend.config import log, cfg
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS checkpoints (
+    thread_id TEXT, checkpoint_ns TEXT, checkpoint_id TEXT, parent_id TEXT,
+    type TEXT, checkpoint BLOB, metadata_type TEXT, metadata BLOB,
+    PRIMARY KEY (thread_id, checkpoint_ns, checkpoint_id)
+);
+CREATE TABLE IF NOT EXISTS writes (
+    thread_id TEXT, checkpoint_ns TEXT, checkpoint_id TEXT, task_id TEXT, idx INTEGER,
+    channel TEXT, type TEXT, value BLOB, task_path TEXT,
+    PRIMARY KEY (thread_id, checkpoint_ns, checkpoint_id, task_id, idx)
+);
+CREATE TABLE IF NOT EXISTS threads (
+    thread_id TEXT PRIMARY KEY, updated_at REAL, bytes INTEGER
+);
+CREATE INDEX IF NOT EXISTS threads_updated ON threads (updated_at);
+"""
+
+
+class SQLiteSaver(BaseCheckpointSaver):
+    """
+    Checkpointer backed by a local SQLite file.
+    Keeps only the latest checkpoint per thread unless `keep_history` is set,
+    and evicts threads idle longer than `ttl` seconds or, oldest first, when
+    the stored checkpoints exceed `max_bytes`.
+    """
+
+    def __init__(self, path: str, ttl: float = 0, max_bytes: int = 0, keep_history: bool = False,
+                 evict_interval: float = 60.0):
+        super().__init__()
+        self.path = path
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.keep_history = keep_history
+        self.evict_interval = evict_interval
+        self._last_evict = 0.0
+        self._lock = threading.Lock()
+
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.execute("PRAGMA auto_vacuum = INCREMENTAL")
+        self.conn.execute("PRAGMA journal_mode = WAL")
+        self.conn.execute("PRAGMA synchronous = NORMAL")
+        self.conn.executescript(SCHEMA)
+
+    def _tuple(self, thread_id: str, checkpoint_ns: str, row: tuple) -> CheckpointTuple:
+        checkpoint_id, parent_id, type_, checkpoint, metadata_type, metadata = row
+        writes = self.conn.execute(
+            "SELECT task_id, channel, type, value FROM writes "
+            "WHERE thread_id = ? AND checkpoint_ns = ? AND checkpoint_id = ? ORDER BY task_path, task_id, idx",
+            (thread_id, checkpoint_ns, checkpoint_id)
+        ).fetchall()
+        return CheckpointTuple(
+            config={"configurable": {
+                "thread_id": thread_id, "checkpoint_ns": checkpoint_ns, "checkpoint_id": checkpoint_id
+            }},
+            checkpoint=self.serde.loads_typed((type_, checkpoint)),
+            metadata=self.serde.loads_typed((metadata_type, metadata)),
+            parent_config=({"configurable": {
+                "thread_id": thread_id, "checkpoint_ns": checkpoint_ns, "checkpoint_id": parent_id
+            }} if parent_id else None),
+            pending_writes=[(task_id, ch, self.serde.loads_typed((t, v))) for task_id, ch, t, v in writes],
+        )
+
+    def get_tuple(self, config: RunnableConfig) -> Optional[CheckpointTuple]:
+        thread_id = config["configurable"]["thread_id"]
+        checkpoint_ns = config["configurable"].get("checkpoint_ns", "")
+        cols = "checkpoint_id, parent_id, type, checkpoint, metadata_type, metadata"
+        with self._lock:
+            if checkpoint_id := get_checkpoint_id(config):
+                row = self.conn.execute(
+                    f"SELECT {cols} FROM checkpoints WHERE thread_id = ? AND checkpoint_ns = ? AND checkpoint_id = ?",
+                    (thread_id, checkpoint_ns, checkpoint_id)
+                ).fetchone()
+            else:
+                row = self.conn.execute(
+                    f"SELECT {cols} FROM checkpoints WHERE thread_id = ? AND checkpoint_ns = ? "
+                    "ORDER BY checkpoint_id DESC LIMIT 1",
+                    (thread_id, checkpoint_ns)
+                ).fetchone()
+            return self._tuple(thread_id, checkpoint_ns, row) if row else None
+
+    def list(self, config: Optional[RunnableConfig], *, filter: Optional[Dict[str, Any]] = None,
+             before: Optional[RunnableConfig] = None, limit: Optional[int] = None) -> Iterator[CheckpointTuple]:
+        where, params = [], []
+        if config:
+            where.append("thread_id = ?")
+            params.append(config["configurable"]["thread_id"])
+            if (ns := config["configurable"].get("checkpoint_ns")) is not None:
+                where.append("checkpoint_ns = ?")
+                params.append(ns)
+            if checkpoint_id := get_checkpoint_id(config):
+                where.append("checkpoint_id = ?")
+                params.append(checkpoint_id)
+        if before and (before_id := get_checkpoint_id(before)):
+            where.append("checkpoint_id < ?")
+            params.append(before_id)
+
+        sql = ("SELECT thread_id, checkpoint_ns, checkpoint_id, parent_id, type, checkpoint, metadata_type, metadata "
+               f"FROM checkpoints {'WHERE ' + ' AND '.join(where) if where else ''} ORDER BY checkpoint_id DESC")
+        with self._lock:
+            rows = self.conn.execute(sql, params).fetchall()
+            results = []
+            for thread_id, checkpoint_ns, *row in rows:
+                tup = self._tuple(thread_id, checkpoint_ns, tuple(row))
+                if filter and not all(tup.metadata.get(k) == v for k, v in filter.items()):
+                    continue
+                results.append(tup)
+                if limit is not None and len(results) >= limit:
+                    break
+        yield from results
+
+    def put(self, config: RunnableConfig, checkpoint: Checkpoint, metadata: CheckpointMetadata,
+            new_versions: ChannelVersions) -> RunnableConfig:
+        thread_id = config["configurable"]["thread_id"]
+        checkpoint_ns = config["configurable"].get("checkpoint_ns", "")
+        type_, data = self.serde.dumps_typed(checkpoint)
+        metadata_type, metadata_b = self.serde.dumps_typed(get_checkpoint_metadata(config, metadata))
+
+        with self._lock, self.conn:
+            self.conn.execute(
+                "INSERT OR REPLACE INTO checkpoints VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                (thread_id, checkpoint_ns, checkpoint["id"], config["configurable"].get("checkpoint_id"),
+                 type_, data, metadata_type, metadata_b)
+            )
+            if not self.keep_history:
+                for table in ("checkpoints", "writes"):
+                    self.conn.execute(
+                        f"DELETE FROM {table} WHERE thread_id = ? AND checkpoint_ns = ? AND checkpoint_id != ?",
+                        (thread_id, checkpoint_ns, checkpoint["id"])
+                    )
+            self.conn.execute(
+                "INSERT OR REPLACE INTO threads VALUES (?, ?, "
+                "(SELECT sum(length(checkpoint)) FROM checkpoints WHERE thread_id = ?))",
+                (thread_id, time.time(), thread_id)
+            )
+        self._maybe_evict()
+        return {"configurable": {
+            "thread_id": thread_id, "checkpoint_ns": checkpoint_ns, "checkpoint_id": checkpoint["id"]
+        }}
+
+    def put_writes(self, config: RunnableConfig, writes: Sequence[tuple], task_id: str, task_path: str = "") -> None:
+        thread_id = config["configurable"]["thread_id"]
+        checkpoint_ns = config["configurable"].get("checkpoint_ns", "")
+        checkpoint_id = config["configurable"]["checkpoint_id"]
+        rows = []
+        for idx, (channel, value) in enumerate(writes):
+            type_, data = self.serde.dumps_typed(value)
+            rows.append((thread_id, checkpoint_ns, checkpoint_id, task_id, WRITES_IDX_MAP.get(channel, idx),
+                         channel, type_, data, task_path))
+        # Regular writes are never overwritten; special channels (errors, interrupts) are
+        verb = "INSERT OR REPLACE" if all(w[0] in WRITES_IDX_MAP for w in writes) else "INSERT OR IGNORE"
+        with self._lock, self.conn:
+            self.conn.executemany(f"{verb} INTO writes VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)", rows)
+
+    def delete_thread(self, thread_id: str) -> None:
+        with self._lock, self.conn:
+            for table in ("checkpoints", "writes", "threads"):
+                self.conn.execute(f"DELETE FROM {table} WHERE thread_id = ?", (thread_id,))
+
+    def _maybe_evict(self):
+        now = time.time()
+        if now - self._last_evict < self.evict_interval:
+            return
+        self._last_evict = now
+        self.evict()
+
+    def evict(self) -> int:
+        """Drop threads past the TTL, then the least recently used ones over the size limit."""
+        victims = []
+        with self._lock:
+            if self.ttl:
+                victims += [r[0] for r in self.conn.execute(
+                    "SELECT thread_id FROM threads WHERE updated_at < ?", (time.time() - self.ttl,)
+                )]
+            if self.max_bytes:
+                total = 0
+                rows = self.conn.execute(
+                    "SELECT thread_id, bytes FROM threads ORDER BY updated_at DESC"
+                ).fetchall()
+                for thread_id, size in rows:
+                    total += size or 0
+                    if total > self.max_bytes and thread_id not in victims:
+                        victims.append(thread_id)
+        for thread_id in victims:
+            self.delete_thread(thread_id)
+        if victims:
+            with self._lock:
+                self.conn.execute("PRAGMA incremental_vacuum")
+            log("Checkpoint", f"Evicted {len(victims)} threads", "Y")
+        return len(victims)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            threads, size = self.conn.execute("SELECT count(*), coalesce(sum(bytes), 0) FROM threads").fetchone()
+        return {"backend": "sqlite", "path": self.path, "threads": threads, "bytes": size,
+                "max_bytes": self.max_bytes, "ttl_seconds": self.ttl}
+
+    async def aget_tuple(self, config: RunnableConfig) -> Optional[CheckpointTuple]:
+        return await asyncio.to_thread(self.get_tuple, config)
+
+    async def alist(self, config: Optional[RunnableConfig], *, filter: Optional[Dict[str, Any]] = None,
+                    before: Optional[RunnableConfig] = None, limit: Optional[int] = None) -> AsyncIterator[CheckpointTuple]:
+        items = await asyncio.to_thread(lambda: list(self.list(config, filter=filter, before=before, limit=limit)))
+        for item in items:
+            yield item
+
+    async def aput(self, config: RunnableConfig, checkpoint: Checkpoint, metadata: CheckpointMetadata,
+                   new_versions: ChannelVersions) -> RunnableConfig:
+        return await asyncio.to_thread(self.put, config, checkpoint, metadata, new_versions)
+
+    async def aput_writes(self, config: RunnableConfig, writes: Sequence[tuple], task_id: str,
+                          task_path: str = "") -> None:
+        return await asyncio.to_thread(self.put_writes, config, writes, task_id, task_path)
+
+    async def adelete_thread(self, thread_id: str) -> None:
+        return await asyncio.to_thread(self.delete_thread, thread_id)
+
+    def get_next_version(self, current: Optional[str], channel: None) -> str:
+        if current is None:
+            current_v = 0
+        elif isinstance(current, int):
+            current_v = current
+        else:
+            current_v = int(current.split(".")[0])
+        return f"{current_v + 1:032}.{random.random():016}"
+
+
+def create_checkpointer() -> BaseCheckpointSaver:
+    if cfg.CHECKPOINT_BACKEND == "sqlite":
+        log("Checkpoint", f"Using SQLite checkpointer at '{cfg.CHECKPOINT_PATH}'", "G")
+        return SQLiteSaver(
+            cfg.CHECKPOINT_PATH,
+            ttl=cfg.CHECKPOINT_TTL_HOURS * 3600,
+            max_bytes=cfg.CHECKPOINT_MAX_MB * 1024 * 1024,
+            keep_history=cfg.CHECKPOINT_KEEP_HISTORY,
+        )
+    return InMemorySaver()
+
+
+def checkpointer_stats(saver: BaseCheckpointSaver) -> Dict[str, Any]:
+    if isinstance(saver, SQLiteSaver):
+        return saver.stats()
+    if isinstance(saver, InMemorySaver):
+        return {"backend": "memory", "threads": len(saver.storage)}
+    return {"backend": type(saver).__name__}
@@ -1,4 +1,5 @@
 import os
+import json
 from pydantic_settings import BaseSettings
 from dotenv import load_dotenv
 
@@ -11,14 +12,90 @@ C = {
 }
 
 
-def log(tag: str, msg: str, color: str = "X"):
+def log(tag: str, msg: str, color: str = "X", **fields):
     from datetime import datetime
-    ts = datetime.now().strftime("%H:%M:%S")
-    print(f"{C['GR']}[{ts}]{C[color]} [{tag}] {msg}{C['X']}")
+    now = datetime.now()
+    if cfg.LOG_JSON:
+        print(json.dumps({"ts": now.isoformat(timespec="milliseconds"), "tag": tag, "msg": msg, **fields},
+                         ensure_ascii=False, default=str), flush=True)
+        return
+    extra = "".join(f" {k}={v}" for k, v in fields.items())
+    print(f"{C['GR']}[{now.strftime('%H:%M:%S')}]{C[color]} [{tag}] {msg}{extra}{C['X']}")
 
 
 class Config(BaseSettings):
     MAX_TOOL_CALLS: int = 8
+    TOOL_CONCURRENCY: int = 4       # tool calls of one turn that run at the same time
+    STREAM_TOKENS: bool = True      # forward LLM tokens as SSE "delta" events
+
+    # Logging and metrics
+    LOG_JSON: bool = False          # one JSON object per log line instead of colored text
+    LOG_SPANS: bool = False         # log every timed stage (LLM, tools, SQL, plotting)
+
+    # Data storage
+    DATA_DIR: str = "data"
+    DB_PATH: str = ""               # DuckDB file for persistent mode, empty = in-memory
+    DB_HASH_SOURCES: bool = False   # confirm size/mtime changes with a content hash
+    DB_LOCK_RETRIES: int = 30       # waits (1s each) for another worker's rebuild
+    SQL_CACHE_MB: int = 256         # result cache for Database.execute, 0 = off
+    DB_POOL_SIZE: int = 4           # concurrent queries (cursors and executor threads)
+    DB_THREADS: int = 0             # DuckDB worker threads, 0 = DuckDB default
+    DB_MEMORY_LIMIT: str = ""       # e.g. "8GB", empty = DuckDB default
+
+    # Query governor
+    SQL_TIMEOUT: float = 30.0                  # seconds before a query is interrupted, 0 = no limit
+    SQL_PREVIEW_ROWS: int = 10                 # rows execute_sql shows the agent; the total is counted separately
+    SQL_MAX_ESTIMATED_ROWS: int = 1_000_000_000  # reject plans with a larger step estimate, 0 = no check
+    SQL_WARN_ESTIMATED_ROWS: int = 50_000_000  # warn the agent above this estimate
+    SQL_COUNT_MAX_ROWS: int = 10_000_000       # preview totals stop counting here ("more than N"), 0 = exact
+    SQL_MAX_RESULT_ROWS: int = 100_000         # max rows loaded for a chart
+
+    # Aggregate rollups
+    ROLLUPS: bool = True                 # build count rollups and route matching queries to them
+    ROLLUP_MIN_ROWS: int = 100_000       # only tables at least this large get a rollup
+    ROLLUP_MAX_CARDINALITY: int = 1000   # columns with more distinct values are not grouped by
+    ROLLUP_MAX_RATIO: float = 0.1        # max rollup rows relative to the source table
+
+    # Answer cache for repeated first questions
+    ANSWER_CACHE_MB: int = 64                # replayed final answers + charts, 0 = off
+    ANSWER_CACHE_TTL_HOURS: float = 24.0     # cached answers expire after this, 0 = never
+    ANSWER_CACHE_EMBED_MODEL: str = ""       # sentence-transformers model for fuzzy matches, empty = exact only
+    ANSWER_CACHE_SIMILARITY: float = 0.92    # min cosine similarity for an embedding match
+
+    # Schema context in the system prompt
+    SCHEMA_MAX_TABLES: int = 8
+    SCHEMA_MAX_COLUMNS: int = 25
+    SCHEMA_SAMPLE_VALUES: int = 5
+    SCHEMA_SAMPLE_MAX_CARDINALITY: int = 50
+
+    # LLM context
+    CONTEXT_TOKEN_BUDGET: int = 6000  # estimated tokens of history sent per LLM call
+    TOOL_SUMMARY_CHARS: int = 300     # past tool results/arguments are cut to this
+
+    # LLM resilience
+    LLM_BREAKER_FAILURES: int = 3      # consecutive primary failures that open the breaker
+    LLM_BREAKER_COOLDOWN: float = 60.0 # seconds the primary is skipped once open
+    LLM_HEDGE_AFTER: float = 0.0       # start fallback if primary is slower (s), 0 = off
+    LLM_RATE_LIMIT: float = 0.0        # LLM requests per second across all conversations, 0 = unlimited
+
+    # Batch questions (/chat/batch)
+    BATCH_CONCURRENCY: int = 8         # questions of one batch answered at the same time (max per request)
+    BATCH_MAX_QUESTIONS: int = 1000
+
+    # Conversation checkpoints
+    CHECKPOINT_BACKEND: str = "sqlite"       # "sqlite" or "memory"
+    CHECKPOINT_PATH: str = "data/checkpoints.sqlite"
+    CHECKPOINT_TTL_HOURS: float = 72.0       # idle threads are dropped after this, 0 = never
+    CHECKPOINT_MAX_MB: int = 512             # oldest threads are dropped above this, 0 = unbounded
+    CHECKPOINT_KEEP_HISTORY: bool = False    # keep every checkpoint instead of only the latest
+
+    # Visualization sandbox
+    VIZ_WORKERS: int = 2
+    VIZ_TIMEOUT: float = 30.0    # wall-clock seconds per chart
+    VIZ_CPU_SECONDS: int = 20    # CPU seconds per chart, 0 = unlimited
+    VIZ_MEMORY_MB: int = 2048    # address-space limit per worker, 0 = unlimited
+    VIZ_MAX_POINTS: int = 5000   # line/scatter traces are downsampled (LTTB) above this
+    VIZ_MAX_BARS: int = 50       # bar categories beyond this are folded into "Прочее"
 
 
 cfg = Config()
@@ -0,0 +1,73 @@
+import json
+from typing import List
+from langchain_core.messages import AnyMessage, AIMessage, HumanMessage, ToolMessage
+from backend.config import log, cfg
+
+CHARS_PER_TOKEN = 3  # conservative for mixed Russian/English text
+
+
+def estimate_tokens(msg: AnyMessage) -> int:
+    size = len(str(msg.content))
+    for tc in getattr(msg, "tool_calls", None) or []:
+        size += len(tc["name"]) + len(json.dumps(tc["args"], ensure_ascii=False))
+    return size // CHARS_PER_TOKEN + 4
+
+
+def _summarize_tool(msg: ToolMessage) -> ToolMessage:
+    text = str(msg.content)
+    if len(text) <= cfg.TOOL_SUMMARY_CHARS:
+        return msg
+    # First line carries the row count/columns for execute_sql, the status otherwise
+    head = text.splitlines()[0][:cfg.TOOL_SUMMARY_CHARS]
+    return msg.model_copy(update={"content": f"{head} ... [{len(text)} chars, truncated]"})
+
+
+def _summarize_call(msg: AIMessage) -> AIMessage:
+    calls = []
+    for tc in msg.tool_calls:
+        args = {k: (v if not isinstance(v, str) or len(v) <= cfg.TOOL_SUMMARY_CHARS else v[:cfg.TOOL_SUMMARY_CHARS] + "...")
+                for k, v in tc["args"].items()}
+        calls.append({**tc, "args": args})
+    return msg.model_copy(update={"tool_calls": calls})
+
+
+def compact_messages(messages: List[AnyMessage], budget: int = None) -> List[AnyMessage]:
+    """
+    Fit the conversation into a token budget before an LLM call.
+    The current turn (from the last human message) is kept verbatim. In earlier
+    turns tool outputs and long tool arguments are collapsed to short summaries,
+    except the latest search_codes result; if that is not enough, the oldest
+    turns are dropped whole so tool calls stay paired with their results.
+    """
+    budget = cfg.CONTEXT_TOKEN_BUDGET if budget is None else budget
+    starts = [i for i, m in enumerate(messages) if isinstance(m, HumanMessage)]
+    if not starts:
+        return list(messages)
+    current = starts[-1]
+
+    last_search = max((i for i, m in enumerate(messages[:current])
+                       if isinstance(m, ToolMessage) and m.name == "search_codes"), default=None)
+    history = []
+    for i, m in enumerate(messages[:current]):
+        if isinstance(m, ToolMessage) and i != last_search:
+            m = _summarize_tool(m)
+        elif isinstance(m, AIMessage) and m.tool_calls:
+            m = _summarize_call(m)
+        history.append(m)
+
+    turns = [history[a:b] for a, b in zip(starts, starts[1:])]
+    prefix = history[:starts[0]]
+    tail = list(messages[current:])
+    used = sum(estimate_tokens(m) for m in prefix + tail)
+    kept = []
+    for turn in reversed(turns):
+        cost = sum(estimate_tokens(m) for m in turn)
+        if used + cost > budget:
+            break
+        kept = turn + kept
+        used += cost
+
+    dropped = len(turns) - sum(1 for m in kept if isinstance(m, HumanMessage))
+    if dropped:
+        log("Context", f"Dropped {dropped} old turns to fit {budget} tokens", "Y")
+    return prefix + kept + tail
@@ -1,71 +1,820 @@
 import os
+import re
+import time
+import queue
+import asyncio
+import json
+import hashlib
+import threading
+import contextvars
 import duckdb
 import pandas as pd
-from typing import Tuple, Optional, List, Any
-from backend.config import log
+import pyarrow as pa
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor
+from typing import Tuple, Optional, List, Any, Dict
+from backend.cache import LRUCache
+from backend.search import SearchIndex
+from backend.rollups import ROLLUP_PREFIX, RollupRouter, build_rollup, drop_rollup, read_rollups
+from backend.metrics import span
+from backend.config import log, cfg
+
+# Tables that get a full-text index: table -> (id column, text column)
+FTS_INDEXES = {
+    "diagnoses": ("diagnosis_code", "diagnosis_name"),
+    "drugs": ("drug_code", "full_name"),
+}
+
+
+QUERY_START_RE = re.compile(r"^\s*(\(|select\b|with\b|from\b|values\b)", re.I)
+# Functions whose result changes between runs of the same SQL; such queries are not cached
+VOLATILE_RE = re.compile(
+    r"\b(current_date|current_time|current_timestamp|localtime|localtimestamp)\b"
+    r"|\b(now|today|random|setseed|uuid|gen_random_uuid|nextval|get_current_time|get_current_timestamp"
+    r"|current_localtime|current_localtimestamp|transaction_timestamp)\s*\(",
+    re.I,
+)
+
+
+def _body(sql: str) -> str:
+    """Query text that can be embedded in a larger statement."""
+    return sql.strip().rstrip(";").strip()
+
+
+def _wrappable(sql: str) -> bool:
+    """True for a single SELECT-like statement that can be used as a subquery."""
+    body = _body(sql)
+    return bool(QUERY_START_RE.match(body)) and ";" not in re.sub(r"'[^']*'", "", body)
+
+
+def _read_csv(files: List[str]) -> str:
+    """read_csv over one file or the partitions of a table; columns are matched by name."""
+    paths = ", ".join("'" + f.replace("'", "''") + "'" for f in files)
+    return f"read_csv([{paths}], auto_detect=True, ignore_errors=True, union_by_name=True)"
+
+
+def _nbytes(value) -> int:
+    """Cache entry size: Arrow tables (results) or small DataFrames (previews)."""
+    if isinstance(value, pa.Table):
+        return value.nbytes
+    return int(value.memory_usage(deep=True).sum())
+
+
+def normalize_sql(sql: str) -> str:
+    """Collapse whitespace outside string literals and drop a trailing semicolon."""
+    parts = sql.strip().rstrip(";").split("'")
+    parts[::2] = [re.sub(r"\s+", " ", p) for p in parts[::2]]
+    return "'".join(parts).strip()
+
+
+def _plan_rows(node: Dict[str, Any], out: List[int]) -> int:
+    """Estimated output rows of a JSON plan node; every node's estimate is appended to `out`."""
+    children = [_plan_rows(c, out) for c in node.get("children", [])]
+    estimate = (node.get("extra_info") or {}).get("Estimated Cardinality")
+    if estimate is not None:
+        rows = int(estimate)
+    elif node.get("name") == "CROSS_PRODUCT":
+        # DuckDB gives no estimate for a cross product; it yields every pair of its inputs
+        rows = 1
+        for c in children:
+            rows *= c
+    else:
+        rows = max(children, default=0)
+    out.append(rows)
+    return rows
+
+
+def _volatile(sql: str) -> bool:
+    """Whether the query calls a time or random function (outside string literals)."""
+    return any(VOLATILE_RE.search(p) for p in sql.split("'")[::2])
+
+
+class CursorPool:
+    """Fixed set of DuckDB cursors, one per running query; callers queue for a free one."""
+
+    def __init__(self, conn, size: int):
+        self.size = size
+        self._free = queue.Queue()
+        for _ in range(size):
+            self._free.put(conn.cursor())
+        self._lock = threading.Lock()
+        self.active = 0
+        self.waiting = 0
+        self.acquired = 0
+        self.wait_total = 0.0
+        self.wait_max = 0.0
+
+    @contextmanager
+    def cursor(self):
+        t0 = time.monotonic()
+        with self._lock:
+            self.waiting += 1
+        cur = self._free.get()
+        if cur is None:
+            # The pool was closed while this caller waited (the store is being reopened)
+            self._free.put(None)
+            with self._lock:
+                self.waiting -= 1
+            raise RuntimeError("Database is being refreshed; retry the query")
+        wait = time.monotonic() - t0
+        with self._lock:
+            self.waiting -= 1
+            self.active += 1
+            self.acquired += 1
+            self.wait_total += wait
+            self.wait_max = max(self.wait_max, wait)
+        try:
+            yield cur
+        finally:
+            with self._lock:
+                self.active -= 1
+            self._free.put(cur)
+
+    def close(self):
+        """Close every cursor, waiting for running queries to return theirs."""
+        for _ in range(self.size):
+            self._free.get().close()
+        self._free.put(None)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "size": self.size, "active": self.active, "waiting": self.waiting,
+            "acquired": self.acquired,
+            "wait_avg_ms": round(1000 * self.wait_total / self.acquired, 2) if self.acquired else 0.0,
+            "wait_max_ms": round(1000 * self.wait_max, 2),
+        }
+
 
 class Database:
-    def __init__(self, data_dir: str = "data"):
-        self.conn = duckdb.connect(":memory:")
+    def __init__(self, data_dir: str = "data", db_path: Optional[str] = None, load: bool = True):
         self.data_dir = data_dir
-        self._init_db()
-    
+        self.db_path = cfg.DB_PATH if db_path is None else db_path
+        self.conn = None
+        self.pool: Optional[CursorPool] = None
+        self.data_version = 0
+        self.cache = LRUCache(cfg.SQL_CACHE_MB * 1024 * 1024, sizeof=_nbytes)
+        self.search_cache = LRUCache(4096)  # entries, not bytes: hit lists are small
+        # Running async calls by key, so concurrent identical queries share one execution
+        self._inflight: Dict[tuple, asyncio.Future] = {}
+        self.executor = ThreadPoolExecutor(max_workers=cfg.DB_POOL_SIZE, thread_name_prefix="duckdb")
+        self.rollups = RollupRouter({})
+        self.search_indexes: Dict[str, SearchIndex] = {}
+        # Per-table load status: pending -> loading -> ready | failed
+        self.progress: Dict[str, Dict[str, Any]] = {}
+        # data_version at which each table (and its rollup) last changed
+        self.table_versions: Dict[str, int] = {}
+        self.ready = threading.Event()
+        # In-memory mode: files each table was loaded from, path -> (size, mtime_ns)
+        self._loaded: Dict[str, Dict[str, tuple]] = {}
+        self._refresh_lock = threading.Lock()
+        if load:
+            self.load()
+
+    def load(self):
+        """Load all sources and build indexes. Blocking; in-memory tables are queryable as each finishes."""
+        t0 = time.time()
+        try:
+            self._init_db()
+        finally:
+            if self.pool is None:
+                self._open(duckdb.connect(":memory:"))
+            self.ready.set()
+        loaded = sum(p["status"] == "ready" for p in self.progress.values())
+        log("DB", f"Ready: {loaded}/{len(self.progress)} tables in {time.time() - t0:.1f}s", "G")
+
+    def _open(self, conn):
+        """Start serving queries from `conn`."""
+        self._configure(conn)
+        self.conn = conn
+        self.rollups.rollups = read_rollups(conn)
+        self.pool = CursorPool(conn, cfg.DB_POOL_SIZE)
+
+    def _set_progress(self, name: str, status: str, **fields):
+        self.progress[name] = {**self.progress.get(name, {}), "status": status, **fields}
+
+    def _table_ready(self, name: str, seconds: float):
+        """Make a freshly loaded table visible: rollup routing, search index, cache invalidation."""
+        self.rollups.rollups = read_rollups(self.conn)
+        if name in FTS_INDEXES:
+            self._build_search_index(name)
+        self._set_progress(name, "ready", seconds=round(seconds, 2))
+        self._data_changed(name)
+
+    def readiness(self) -> Dict[str, Any]:
+        return {"ready": self.ready.is_set(), "data_version": self.data_version, "tables": dict(self.progress)}
+
+    def _data_changed(self, *tables: str):
+        """Bump the data version so cached results are invalidated and `tables` get re-profiled."""
+        self.data_version += 1
+        for name in tables:
+            self.table_versions[name] = self.table_versions[f"{ROLLUP_PREFIX}{name}"] = self.data_version
+        self.cache.clear()
+        self.search_cache.clear()
+
     def _init_db(self):
         if not os.path.exists(self.data_dir):
             log("DB", f"Directory '{self.data_dir}' not found", "R")
             return
-        
+
+        sources = self._scan_sources()
+        for name in sources:
+            self._set_progress(name, "pending")
+        if not self.db_path:
+            self._open(duckdb.connect(":memory:"))
+            self._load_extensions(self.conn)
+            self._sync_memory(sources)
+            return
+        # The store is opened read-only after the rebuild, so its tables become available together
+        for name in sources:
+            self._set_progress(name, "loading")
+        self._sync_store(sources)
+
+    def refresh(self) -> Dict[str, Any]:
+        """
+        Pick up new, changed and removed sources without a restart. In-memory tables
+        get new partitions appended or are rebuilt and swapped in one statement, so
+        running queries keep their snapshot and are never interrupted.
+        """
+        if not self.ready.is_set():
+            raise RuntimeError("Initial load is still running")
+        with self._refresh_lock:
+            t0 = time.time()
+            sources = self._scan_sources() if os.path.exists(self.data_dir) else {}
+            summary = self._sync_store(sources, reopen=True) if self.db_path else self._sync_memory(sources)
+            changed = len(summary["loaded"]) + len(summary["appended"]) + len(summary["dropped"])
+            log("DB", f"Refresh: {changed} table(s) changed in {time.time() - t0:.1f}s", "G")
+            return {**summary, "data_version": self.data_version, "seconds": round(time.time() - t0, 2)}
+
+    def _forget(self, name: str):
+        self._loaded.pop(name, None)
+        self.progress.pop(name, None)
+        self.search_indexes.pop(name, None)
+
+    def _sync_memory(self, sources: Dict[str, Dict[str, Any]]) -> Dict[str, Any]:
+        """Bring the in-memory database in line with `sources`, one table at a time."""
+        summary: Dict[str, Any] = {"loaded": [], "appended": {}, "dropped": [], "failed": []}
+        for name in set(self._loaded) - set(sources):
+            self._drop_table(self.conn, name)
+            self._forget(name)
+            summary["dropped"].append(name)
+            log("DB", f"Dropped '{name}' (source removed)", "Y")
+        if summary["dropped"]:
+            self.rollups.rollups = read_rollups(self.conn)
+            self._data_changed(*summary["dropped"])
+
+        for name, src in sources.items():
+            loaded = self._loaded.get(name)
+            if loaded == src["files"]:
+                continue
+            t0 = time.time()
+            self._set_progress(name, "loading")
+            # Stop routing to the old rollup until it is rebuilt from the new data
+            self.rollups.rollups = {k: v for k, v in self.rollups.rollups.items() if k != name}
+            new = self._new_partitions(src, loaded)
+            if new and self._append_partitions(self.conn, name, new):
+                summary["appended"][name] = len(new)
+            elif self._load_table(self.conn, name, list(src["files"])):
+                summary["loaded"].append(name)
+            else:
+                # A failed reload leaves the previous version of the table in place
+                self.rollups.rollups = read_rollups(self.conn)
+                self._set_progress(name, "failed")
+                summary["failed"].append(name)
+                continue
+            self._build_rollup(self.conn, name)
+            self._loaded[name] = src["files"]
+            self._table_ready(name, time.time() - t0)
+        return summary
+
+    def _sync_store(self, sources: Dict[str, Dict[str, Any]], reopen: bool = False) -> Dict[str, Any]:
+        """Rebuild changed tables of the persistent store and (re)open it read-only."""
+        summary: Dict[str, Any] = {"loaded": [], "appended": {}, "dropped": [], "failed": []}
+        if reopen and self._is_fresh(sources):
+            return summary
+        if reopen:
+            # This process can only write the file once its read-only handle is closed,
+            # so queries issued during the rebuild get a retry message
+            pool, conn = self.pool, self.conn
+            self.pool = None
+            pool.close()
+            conn.close()
+
+        t0 = time.time()
+        locked = False
+        try:
+            for _ in range(max(cfg.DB_LOCK_RETRIES, 1)):
+                if self._is_fresh(sources):
+                    break
+                try:
+                    summary = self._rebuild(sources)
+                    break
+                except duckdb.IOException as e:
+                    # Another worker holds the write lock and is rebuilding the store
+                    log("DB", f"Store is locked, waiting: {e}", "Y")
+                    time.sleep(1)
+            else:
+                locked = True
+        finally:
+            self._open(duckdb.connect(self.db_path, read_only=True))
+            self._load_extensions(self.conn)
+            log("DB", f"Opened persistent store '{self.db_path}' (read-only)", "G")
+
+        if locked:
+            # Still serving the old store: report every pending change as failed
+            manifest = self._read_manifest(self.conn)
+            summary["failed"] = sorted(set(self._changed(sources, manifest)) | (set(manifest) - set(sources)))
+            log("DB", f"Store stayed locked, not updated: {summary['failed']}", "R")
+
+        tables = {t[0] for t in self.fetchall("SHOW TABLES")}
+        for name in set(self.progress) - set(sources):
+            self._forget(name)
+        changed = set(summary["loaded"]) | set(summary["appended"])
+        for name in sources:
+            if name not in tables:
+                self._set_progress(name, "failed")
+                continue
+            if reopen and name not in changed and self.progress.get(name, {}).get("status") == "ready":
+                continue
+            if name in FTS_INDEXES:
+                self._build_search_index(name)
+            self._set_progress(name, "ready", seconds=round(time.time() - t0, 2))
+        self._data_changed(*changed, *summary["dropped"])
+        return summary
+
+    def _build_search_index(self, name: str):
+        col_id, col_text = FTS_INDEXES[name]
+        try:
+            t0 = time.time()
+            self.search_indexes[name] = SearchIndex(self.fetchall(f"SELECT {col_id}, {col_text} FROM {name}"))
+            log("DB", f"Search index for '{name}': {len(self.search_indexes[name])} rows in {time.time() - t0:.1f}s", "G")
+        except Exception as e:
+            self.search_indexes.pop(name, None)
+            log("DB", f"Could not build search index for '{name}': {e}", "Y")
+
+    def _configure(self, conn):
+        if cfg.DB_THREADS:
+            conn.execute(f"SET threads = {cfg.DB_THREADS}")
+        if cfg.DB_MEMORY_LIMIT:
+            conn.execute(f"SET memory_limit = '{cfg.DB_MEMORY_LIMIT}'")
+
+    def _load_extensions(self, conn):
         try:
-            self.conn.execute("INSTALL fts; LOAD fts;")
+            conn.execute("INSTALL fts; LOAD fts;")
         except Exception as e:
             log("DB", f"Could not load FTS extension: {e}", "Y")
 
-        files = [f for f in os.listdir(self.data_dir) if f.endswith('.csv')]
-        for f in files:
-            name = f.replace('.csv', '')
-            path = os.path.join(self.data_dir, f)
+    def _load_table(self, conn, name: str, files: List[str]) -> bool:
+        """(Re)create a table from its files; the replacement is atomic for concurrent readers."""
+        try:
+            conn.execute(f"CREATE OR REPLACE TABLE {name} AS SELECT * FROM {_read_csv(files)}")
+        except Exception as e:
+            log("DB", f"Error loading '{name}': {e}", "R")
+            return False
+        self._index_fts(conn, name)
+        return True
+
+    def _append_partitions(self, conn, name: str, files: List[str]) -> bool:
+        """Insert new partition files into an existing table in one transaction."""
+        try:
+            conn.execute(f"INSERT INTO {name} BY NAME SELECT * FROM {_read_csv(files)}")
+        except Exception as e:
+            log("DB", f"Could not append to '{name}', reloading it: {e}", "Y")
+            return False
+        log("DB", f"Appended {len(files)} partition(s) to '{name}'", "G")
+        self._index_fts(conn, name)
+        return True
+
+    def _new_partitions(self, src: Dict[str, Any], loaded: Optional[Dict[str, tuple]]) -> Optional[List[str]]:
+        """Files to append when a partitioned source only gained files; None if it needs a full reload."""
+        if not loaded or not os.path.isdir(src["path"]):
+            return None
+        if any(src["files"].get(path) != fp for path, fp in loaded.items()):
+            return None
+        return [path for path in src["files"] if path not in loaded] or None
+
+    def _index_fts(self, conn, name: str):
+        if name not in FTS_INDEXES:
+            return
+        col_id, col_text = FTS_INDEXES[name]
+        try:
+            conn.execute(f"PRAGMA create_fts_index('{name}', '{col_id}', '{col_text}', overwrite=1)")
+            log("DB", f"Indexed '{name}' for search", "G")
+        except Exception as e:
+            log("DB", f"Could not create FTS index for '{name}': {e}", "Y")
+
+    def _drop_table(self, conn, name: str):
+        if name in FTS_INDEXES:
             try:
-                self.conn.execute(f"""
-                    CREATE TABLE {name} AS 
-                    SELECT * FROM read_csv('{path}', auto_detect=True, ignore_errors=True)
-                """)
-                
-                if name == "diagnoses":
-                    self.conn.execute(f"PRAGMA create_fts_index('diagnoses', 'diagnosis_code', 'diagnosis_name')")
-                    log("DB", "Indexed 'diagnoses' for search", "G")
-                elif name == "drugs":
-                    self.conn.execute(f"PRAGMA create_fts_index('drugs', 'drug_code', 'full_name')")
-                    log("DB", "Indexed 'drugs' for search", "G")
-                    
-            except Exception as e:
-                log("DB", f"Error loading {f}: {e}", "R")
-    
+                conn.execute(f"PRAGMA drop_fts_index('{name}')")
+            except duckdb.Error:
+                pass
+        conn.execute(f"DROP TABLE IF EXISTS {name}")
+        drop_rollup(conn, name)
+
+    def _build_rollup(self, conn, name: str):
+        try:
+            if not cfg.ROLLUPS:
+                # A rollup left by an earlier run would no longer match the reloaded table
+                drop_rollup(conn, name)
+                return
+            build_rollup(conn, name)
+        except Exception as e:
+            log("DB", f"Could not build rollup for '{name}': {e}", "Y")
+
+    def _scan_sources(self) -> Dict[str, Dict[str, Any]]:
+        """
+        Fingerprint the data directory. A table comes from `<table>.csv` or from a
+        `<table>/` directory of CSV partitions: path, total size, latest mtime and
+        per-file (size, mtime_ns).
+        """
+        sources = {}
+        for f in sorted(os.listdir(self.data_dir)):
+            path = os.path.join(self.data_dir, f)
+            if f.endswith('.csv') and os.path.isfile(path):
+                name, files = f.replace('.csv', ''), [path]
+            elif os.path.isdir(path) and not f.startswith('.'):
+                name = f
+                files = [os.path.join(path, p) for p in sorted(os.listdir(path)) if p.endswith('.csv')]
+                if not files:
+                    continue
+            else:
+                continue
+            stats = {p: os.stat(p) for p in files}
+            sources[name] = {
+                "path": path,
+                "size": sum(st.st_size for st in stats.values()),
+                "mtime_ns": max(st.st_mtime_ns for st in stats.values()),
+                "files": {p: (st.st_size, st.st_mtime_ns) for p, st in stats.items()},
+            }
+        return sources
+
+    def _digest(self, path: str) -> str:
+        h = hashlib.sha256()
+        with open(path, "rb") as fh:
+            for chunk in iter(lambda: fh.read(1 << 20), b""):
+                h.update(chunk)
+        return h.hexdigest()
+
+    def _read_manifest(self, conn) -> Dict[str, Dict[str, Any]]:
+        try:
+            rows = conn.execute("SELECT name, path, size, mtime_ns, digest FROM meta.sources").fetchall()
+        except duckdb.Error:
+            return {}
+        manifest = {r[0]: {"path": r[1], "size": r[2], "mtime_ns": r[3], "digest": r[4]} for r in rows}
+        try:
+            for name, files in self._read_files(conn).items():
+                if name in manifest:
+                    manifest[name]["files"] = files
+        except duckdb.Error:
+            pass  # store written before partitions were tracked
+        return manifest
+
+    def _changed(self, sources: Dict[str, Dict[str, Any]], manifest: Dict[str, Dict[str, Any]]) -> List[str]:
+        """Names of sources whose file differs from the manifest entry."""
+        changed = []
+        for name, src in sources.items():
+            old = manifest.get(name)
+            if (old and old["path"] == src["path"] and old["size"] == src["size"]
+                    and old["mtime_ns"] == src["mtime_ns"] and old.get("files", src["files"]) == src["files"]):
+                continue
+            if (old and cfg.DB_HASH_SOURCES and old["digest"] and old["size"] == src["size"]
+                    and os.path.isfile(src["path"])):
+                src["digest"] = self._digest(src["path"])
+                if src["digest"] == old["digest"]:
+                    continue
+            changed.append(name)
+        return changed
+
+    def _is_fresh(self, sources: Dict[str, Dict[str, Any]]) -> bool:
+        if not os.path.exists(self.db_path):
+            return False
+        try:
+            conn = duckdb.connect(self.db_path, read_only=True)
+        except duckdb.Error:
+            return False
+        try:
+            manifest = self._read_manifest(conn)
+        finally:
+            conn.close()
+        return set(manifest) == set(sources) and not self._changed(sources, manifest)
+
+    def _read_files(self, conn) -> Dict[str, Dict[str, tuple]]:
+        """Files each stored table was built from: table -> path -> (size, mtime_ns)."""
+        out: Dict[str, Dict[str, tuple]] = {}
+        for name, path, size, mtime_ns in conn.execute("SELECT name, path, size, mtime_ns FROM meta.files").fetchall():
+            out.setdefault(name, {})[path] = (size, mtime_ns)
+        return out
+
+    def _rebuild(self, sources: Dict[str, Dict[str, Any]]) -> Dict[str, Any]:
+        """Reload only new or changed sources into the persistent store; new partitions are appended."""
+        summary: Dict[str, Any] = {"loaded": [], "appended": {}, "dropped": [], "failed": []}
+        conn = duckdb.connect(self.db_path)
+        try:
+            self._load_extensions(conn)
+            conn.execute("CREATE SCHEMA IF NOT EXISTS meta")
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS meta.sources (
+                    name VARCHAR PRIMARY KEY, path VARCHAR, size BIGINT, mtime_ns BIGINT, digest VARCHAR
+                )
+            """)
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS meta.files (name VARCHAR, path VARCHAR, size BIGINT, mtime_ns BIGINT)
+            """)
+            manifest = self._read_manifest(conn)
+
+            for name in set(manifest) - set(sources):
+                self._drop_table(conn, name)
+                conn.execute("DELETE FROM meta.sources WHERE name = ?", [name])
+                conn.execute("DELETE FROM meta.files WHERE name = ?", [name])
+                summary["dropped"].append(name)
+                log("DB", f"Dropped '{name}' (source removed)", "Y")
+
+            for name in self._changed(sources, manifest):
+                src = sources[name]
+                t0 = time.time()
+                new = self._new_partitions(src, manifest.get(name, {}).get("files"))
+                if new and self._append_partitions(conn, name, new):
+                    summary["appended"][name] = len(new)
+                elif self._load_table(conn, name, list(src["files"])):
+                    summary["loaded"].append(name)
+                else:
+                    summary["failed"].append(name)
+                    continue
+                self._build_rollup(conn, name)
+                digest = src.get("digest")
+                if not digest and cfg.DB_HASH_SOURCES and os.path.isfile(src["path"]):
+                    digest = self._digest(src["path"])
+                conn.execute(
+                    "INSERT OR REPLACE INTO meta.sources VALUES (?, ?, ?, ?, ?)",
+                    [name, src["path"], src["size"], src["mtime_ns"], digest]
+                )
+                conn.execute("DELETE FROM meta.files WHERE name = ?", [name])
+                conn.executemany("INSERT INTO meta.files VALUES (?, ?, ?, ?)",
+                                 [[name, path, size, mtime] for path, (size, mtime) in src["files"].items()])
+                log("DB", f"Rebuilt '{name}' in {time.time() - t0:.1f}s", "G")
+            conn.execute("CHECKPOINT")
+        finally:
+            conn.close()
+        return summary
+
+    def fetchall(self, sql: str, params: Optional[List[Any]] = None) -> List[tuple]:
+        """Internal metadata query on a pooled cursor: no guard, no cache, raises on error."""
+        if self.pool is None:
+            raise RuntimeError("Database is still loading")
+        with self.pool.cursor() as cur:
+            return cur.execute(sql, params or []).fetchall()
+
+    def stats(self) -> Dict[str, Any]:
+        return {"data_version": self.data_version, "ready": self.ready.is_set(),
+                "pool": self.pool.stats() if self.pool else {}, "cache": self.cache.stats(),
+                "rollups": self.rollups.stats()}
+
     def get_schema(self) -> str:
         try:
-            tables = [t[0] for t in self.conn.execute("SHOW TABLES").fetchall()]
+            tables = [t[0] for t in self.fetchall("SHOW TABLES")]
             out = []
             for t in tables:
-                cols = self.conn.execute(f"DESCRIBE {t}").fetchall()
+                cols = self.fetchall(f"DESCRIBE {t}")
                 col_str = ", ".join([f"{c[0]}:{c[1]}" for c in cols])
                 out.append(f"TABLE {t} ({col_str})")
             return "\n".join(out)
         except:
             return "No tables found."
 
-    def execute(self, sql: str, params: Optional[List[Any]] = None) -> Tuple[Optional[pd.DataFrame], Optional[str]]:
+    def _cache_key(self, sql: str, params: Optional[List[Any]]) -> tuple:
+        return normalize_sql(sql), tuple(params or ()), self.data_version
+
+    @contextmanager
+    def _deadline(self, cur):
+        """Interrupt the cursor's running query after SQL_TIMEOUT seconds."""
+        if not cfg.SQL_TIMEOUT:
+            yield
+            return
+        timer = threading.Timer(cfg.SQL_TIMEOUT, cur.interrupt)
+        timer.daemon = True
+        timer.start()
+        try:
+            yield
+        finally:
+            timer.cancel()
+
+    def _timeout_error(self) -> str:
+        return (f"Query cancelled after {cfg.SQL_TIMEOUT:.0f}s. Aggregate in SQL (GROUP BY), "
+                f"add WHERE filters or check join conditions.")
+
+    def _check_plan(self, cur, sql: str, params: Optional[List[Any]]) -> Tuple[Optional[str], Optional[str]]:
+        """(error, warning) from the optimizer's row estimates of the query plan."""
+        if not (cfg.SQL_MAX_ESTIMATED_ROWS or cfg.SQL_WARN_ESTIMATED_ROWS) or not _wrappable(sql):
+            return None, None
+        try:
+            plan = cur.execute(f"EXPLAIN (FORMAT JSON) {_body(sql)}", params or []).fetchall()
+        except duckdb.Error:
+            return None, None  # binding errors surface when the query itself runs
+        estimates: List[int] = []
+        for root in json.loads(plan[0][1]) if plan else []:
+            _plan_rows(root, estimates)
+        estimate = max(estimates, default=0)
+        if cfg.SQL_MAX_ESTIMATED_ROWS and estimate > cfg.SQL_MAX_ESTIMATED_ROWS:
+            return (f"Query rejected: the plan produces ~{estimate:,} rows at some step "
+                    f"(limit {cfg.SQL_MAX_ESTIMATED_ROWS:,}). Likely a missing join condition or "
+                    f"an unfiltered self-join; add join keys, WHERE filters or aggregate earlier."), None
+        if cfg.SQL_WARN_ESTIMATED_ROWS and estimate > cfg.SQL_WARN_ESTIMATED_ROWS:
+            return None, f"Warning: the plan estimates ~{estimate:,} intermediate rows; the query may be slow."
+        return None, None
+
+    def _count(self, cur, body: str) -> Tuple[Any, bool]:
+        """(row count of a query, whether it is exact), capped at SQL_COUNT_MAX_ROWS."""
+        cap = cfg.SQL_COUNT_MAX_ROWS
+        rows = f"SELECT 1 FROM ({body}\n) AS q" + (f" LIMIT {cap + 1}" if cap else "")
+        try:
+            with span("sql", source="count"):
+                n = cur.execute(f"SELECT count(*) FROM ({rows}) AS c").fetchone()[0]
+        except duckdb.InterruptException:
+            # Keep the rows already fetched rather than failing the whole preview
+            return f"unknown (counting stopped after {cfg.SQL_TIMEOUT:.0f}s)", False
+        if cap and n > cap:
+            return f"more than {cap:,}", True
+        return int(n), True
+
+    def _fetch(self, cur, sql: str, params: Optional[List[Any]] = None, source: str = "table") -> pa.Table:
+        with span("sql", source=source):
+            rel = cur.execute(sql, params) if params else cur.execute(sql)
+        with span("to_arrow"):
+            return rel.to_arrow_table()
+
+    def _execute_rollup(self, cur, sql: str) -> Optional[pa.Table]:
+        """Answer an aggregate from a rollup table; None if no rollup applies or it fails."""
+        if not cfg.ROLLUPS:
+            return None
+        rewrite = self.rollups.rewrite(sql)
+        if rewrite is None:
+            return None
+        rewritten, rollup = rewrite
+        try:
+            # Binding the original query validates it and gives the column names the agent expects
+            names = [c[0] for c in cur.execute(f"DESCRIBE {_body(sql)}").fetchall()]
+            table = self._fetch(cur, rewritten, source="rollup").rename_columns(names)
+            self.rollups.rewrites += 1
+            log("DB", f"Served from '{rollup}'", "C")
+            return table
+        except duckdb.InterruptException:
+            raise
+        except Exception as e:
+            log("DB", f"Rollup rewrite failed, using source table: {e}", "Y")
+            return None
+
+    async def _in_executor(self, fn, *args):
+        loop = asyncio.get_running_loop()
+        # Executor threads do not inherit context vars; carry them for request spans
+        ctx = contextvars.copy_context()
+        return await loop.run_in_executor(self.executor, ctx.run, fn, *args)
+
+    async def aexecute(self, sql: str, params: Optional[List[Any]] = None,
+                       max_rows: Optional[int] = None) -> Tuple[Optional[pd.DataFrame], Optional[str]]:
+        """`execute` on the DB executor so the event loop is never blocked by a query."""
+        return await self._in_executor(self.execute, sql, params, max_rows)
+
+    async def _shared(self, key: tuple, run):
+        """Await `run()` once for all concurrent callers with the same key (single flight)."""
+        future = self._inflight.get(key)
+        if future is None:
+            future = asyncio.ensure_future(run())
+            self._inflight[key] = future
+            future.add_done_callback(lambda _: self._inflight.pop(key, None))
+        # A cancelled caller must not cancel the execution others are waiting for
+        return await asyncio.shield(future)
+
+    async def aexecute_arrow(self, sql: str, params: Optional[List[Any]] = None,
+                             max_rows: Optional[int] = None) -> Tuple[Optional[pa.Table], Optional[str]]:
+        key = ("execute",) + self._cache_key(sql, params) + (max_rows,)
+        return await self._shared(key, lambda: self._in_executor(self.execute_arrow, sql, params, max_rows))
+
+    async def apreview(self, sql: str, limit: int = 10) -> Tuple[Optional[pd.DataFrame], Optional[str]]:
+        key = ("preview",) + self._cache_key(sql, None) + (limit,)
+        return await self._shared(key, lambda: self._in_executor(self.preview, sql, limit))
+
+    async def asearch(self, table: str, keywords: List[str], limit: int = 20) -> Optional[list]:
+        """Cached, single-flight SearchIndex.search_many; None if the table has no index."""
+        index = self.search_indexes.get(table)
+        if index is None:
+            return None
+        key = ("search", table, tuple(keywords), limit, self.data_version)
+        hits = self.search_cache.get(key)
+        if hits is None:
+            hits = await self._shared(key, lambda: asyncio.to_thread(index.search_many, keywords, limit))
+            self.search_cache.put(key, hits)
+        return hits
+
+    def _guard(self, sql: str) -> Optional[str]:
+        if self.pool is None:
+            return "Database is still loading; retry in a few seconds."
+        forbidden = ["DROP", "DELETE", "UPDATE", "INSERT", "ALTER", "TRUNCATE"]
+        if any(w in sql.upper() for w in forbidden):
+            return "Security Violation: Read-only access permitted."
+        return None
+
+    def execute_arrow(self, sql: str, params: Optional[List[Any]] = None,
+                      max_rows: Optional[int] = None) -> Tuple[Optional[pa.Table], Optional[str]]:
+        """
+        Executes SQL and returns (Arrow table, ErrorString).
+        Results are cached per data version; Arrow tables are immutable, so callers share them.
+        With `max_rows`, larger results are refused instead of materialized.
+        """
+        err = self._guard(sql)
+        if err:
+            return None, err
+
+        key = self._cache_key(sql, params) + (max_rows,)
+        cacheable = cfg.SQL_CACHE_MB and not _volatile(sql)
+        if cacheable:
+            table = self.cache.get(key)
+            if table is not None:
+                return table, None
+
+        try:
+            with self.pool.cursor() as cur, self._deadline(cur):
+                table = None if params else self._execute_rollup(cur, sql)
+                if table is None:
+                    err, _ = self._check_plan(cur, sql, params)
+                    if err:
+                        return None, err
+                    run = sql
+                    if max_rows and _wrappable(sql):
+                        run = f"SELECT * FROM ({_body(sql)}\n) AS q LIMIT {max_rows + 1}"
+                    table = self._fetch(cur, run, params)
+            if max_rows and table.num_rows > max_rows:
+                return None, (f"Result has more than {max_rows:,} rows. Aggregate (GROUP BY) or "
+                              f"filter the data to at most {max_rows:,} rows.")
+            if cacheable:
+                self.cache.put(key, table)
+            return table, None
+        except duckdb.InterruptException:
+            return None, self._timeout_error()
+        except Exception as e:
+            return None, str(e)
+
+    def execute(self, sql: str, params: Optional[List[Any]] = None,
+                max_rows: Optional[int] = None) -> Tuple[Optional[pd.DataFrame], Optional[str]]:
         """
         Executes SQL and returns (DataFrame, ErrorString).
         ALWAYS returns a tuple of size 2.
+        Converts `execute_arrow`'s result; prefer that when pandas is not needed.
         """
-        forbidden = ["DROP", "DELETE", "UPDATE", "INSERT", "ALTER", "TRUNCATE"]
-        if any(w in sql.upper() for w in forbidden):
-            return None, "Security Violation: Read-only access permitted."
-        
+        table, err = self.execute_arrow(sql, params, max_rows)
+        if table is None:
+            return None, err
+        with span("to_pandas"):
+            return table.to_pandas(), None
+
+    def preview(self, sql: str, limit: int = 10) -> Tuple[Optional[pd.DataFrame], Optional[str]]:
+        """
+        First `limit` rows of a query without materializing the rest, plus the total
+        row count in `df.attrs["total_rows"]` and a plan warning in `df.attrs["warning"]`.
+        The total is text ("more than N", "unknown ...") when counting is capped or times out.
+        """
+        if not _wrappable(sql):
+            table, err = self.execute_arrow(sql)
+            if table is None:
+                return None, err
+            df = table.slice(0, limit).to_pandas()
+            df.attrs["total_rows"] = table.num_rows
+            return df, None
+        err = self._guard(sql)
+        if err:
+            return None, err
+
+        key = self._cache_key(sql, None) + ("preview", limit)
+        cacheable = cfg.SQL_CACHE_MB and not _volatile(sql)
+        if cacheable:
+            df = self.cache.get(key)
+            if df is not None:
+                return df, None
+
         try:
-            if params:
-                df = self.conn.execute(sql, params).df()
-            else:
-                df = self.conn.execute(sql).df()
+            with self.pool.cursor() as cur, self._deadline(cur):
+                warning = None
+                table = self._execute_rollup(cur, sql)
+                if table is not None:
+                    total = table.num_rows
+                else:
+                    err, warning = self._check_plan(cur, sql, None)
+                    if err:
+                        return None, err
+                    body = _body(sql)
+                    table = self._fetch(cur, f"SELECT * FROM ({body}\n) AS q LIMIT {limit + 1}", source="preview")
+                    total = table.num_rows
+                    if total > limit:
+                        total, counted = self._count(cur, body)
+                        cacheable = cacheable and counted
+            # Only the shown rows are converted to pandas
+            df = table.slice(0, limit).to_pandas()
+            df.attrs["total_rows"] = total
+            if warning:
+                df.attrs["warning"] = warning
+            if cacheable:
+                self.cache.put(key, df)
             return df, None
+        except duckdb.InterruptException:
+            return None, self._timeout_error()
         except Exception as e:
-            return None, str(e)
\ No newline at end of file
+            return None, str(e)
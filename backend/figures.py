@@ -0,0 +1,262 @@
+import base64
+import numpy as np
+import pandas as pd
+import plotly.graph_objects as go
+from typing import Any, Dict, List, Optional
+from backend.config import cfg
+
+# Per-point trace attributes that must be sliced together with x/y
+POINT_ATTRS = ("x", "y", "text", "hovertext", "customdata")
+# Per-point attributes nested in marker / error bars
+MARKER_ATTRS = ("color", "size", "symbol", "opacity")
+ERROR_ATTRS = ("array", "arrayminus")
+# Trace keys that are sent as base64 typed arrays when numeric
+TYPED_KEYS = ("x", "y", "z", "values", "r", "theta", "lat", "lon", "open", "high", "low", "close")
+TYPED_MIN_LEN = 32
+
+
+def lttb(x: np.ndarray, y: np.ndarray, n_out: int) -> np.ndarray:
+    """Indices of the points kept by Largest-Triangle-Three-Buckets downsampling."""
+    n = len(x)
+    if n_out >= n or n_out < 3:
+        return np.arange(n)
+
+    edges = np.linspace(1, n - 1, n_out - 1).astype(int)
+    keep = [0]
+    a = 0
+    for i in range(n_out - 2):
+        lo, hi = edges[i], max(edges[i + 1], edges[i] + 1)
+        if i + 2 < len(edges):
+            nxt = slice(edges[i + 1], max(edges[i + 2], edges[i + 1] + 1))
+            cx, cy = x[nxt].mean(), y[nxt].mean()
+        else:
+            cx, cy = x[-1], y[-1]
+        area = np.abs((x[a] - cx) * (y[lo:hi] - y[a]) - (x[a] - x[lo:hi]) * (cy - y[a]))
+        a = lo + int(np.argmax(area))
+        keep.append(a)
+    keep.append(n - 1)
+    return np.asarray(keep)
+
+
+def _numeric(values) -> np.ndarray:
+    """Float view of x values for downsampling: numbers, dates, or positions for categories."""
+    arr = np.asarray(values)
+    if np.issubdtype(arr.dtype, np.number):
+        return arr.astype(float)
+    try:
+        return pd.to_datetime(arr).asi8.astype(float)
+    except (ValueError, TypeError):
+        return np.arange(len(arr), dtype=float)
+
+
+def _is_array(val, n: int) -> bool:
+    return val is not None and not isinstance(val, str) and np.ndim(val) == 1 and len(val) == n
+
+
+def _downsample_scatter(trace, max_points: int):
+    if trace.x is None or trace.y is None or len(trace.y) <= max_points:
+        return trace
+    try:
+        y = np.nan_to_num(np.asarray(trace.y, dtype=float))
+    except (ValueError, TypeError):
+        return trace
+    n = len(trace.y)
+    x = np.nan_to_num(_numeric(trace.x))
+    if len(x) != n:
+        return trace
+    if np.all(np.diff(x) >= 0):
+        keep = lttb(x, y, max_points)
+    else:
+        # LTTB needs ordered x; a marker cloud is thinned by a fixed random sample
+        keep = np.sort(np.random.default_rng(0).choice(n, max_points, replace=False))
+
+    updates = {}
+    for attr in POINT_ATTRS:
+        val = getattr(trace, attr, None)
+        if _is_array(val, n):
+            updates[attr] = np.asarray(val)[keep]
+    for attr in MARKER_ATTRS:
+        val = trace.marker[attr]
+        if _is_array(val, n):
+            updates[f"marker_{attr}"] = np.asarray(val)[keep]
+    for err in ("error_x", "error_y"):
+        for attr in ERROR_ATTRS:
+            val = trace[err][attr]
+            if _is_array(val, n):
+                updates[f"{err}_{attr}"] = np.asarray(val)[keep]
+    trace.update(updates)
+    return trace
+
+
+def _histogram_values(trace):
+    """(binned values, weights or None, horizontal) of a histogram trace, or None if it is left to plotly."""
+    if trace.xbins.size is not None or trace.ybins.size is not None or trace.cumulative.enabled:
+        return None
+    horizontal = trace.orientation == "h" or (trace.x is None and trace.orientation != "v")
+    values, other = (trace.y, trace.x) if horizontal else (trace.x, trace.y)
+    if values is None:
+        return None
+    try:
+        arr = np.asarray(values, dtype=float)
+        weights = None if other is None else np.asarray(other, dtype=float)
+    except (ValueError, TypeError):
+        return None
+    if weights is not None and len(weights) != len(arr):
+        return None
+    return arr, weights, horizontal
+
+
+def _aggregate(arr, weights, edges, histfunc: str, histnorm: str) -> np.ndarray:
+    """Per-bin values as plotly computes them for `histfunc` / `histnorm`."""
+    ok = ~np.isnan(arr) if weights is None else ~(np.isnan(arr) | np.isnan(weights))
+    arr = arr[ok]
+    weights = None if weights is None else weights[ok]
+    counts = np.histogram(arr, bins=edges)[0].astype(float)
+    if weights is None or histfunc == "count":
+        vals = counts
+    elif histfunc == "sum":
+        vals = np.histogram(arr, bins=edges, weights=weights)[0]
+    elif histfunc == "avg":
+        sums = np.histogram(arr, bins=edges, weights=weights)[0]
+        vals = np.divide(sums, counts, out=np.full_like(sums, np.nan), where=counts > 0)
+    else:  # min / max
+        bins = np.clip(np.searchsorted(edges, arr, side="right") - 1, 0, len(edges) - 2)
+        grouped = pd.Series(weights).groupby(bins).agg(histfunc)
+        vals = grouped.reindex(range(len(edges) - 1)).to_numpy(dtype=float)
+
+    total = np.nansum(vals)
+    widths = np.diff(edges)
+    if histnorm == "percent":
+        vals = 100 * vals / total if total else vals
+    elif histnorm == "probability":
+        vals = vals / total if total else vals
+    elif histnorm == "density":
+        vals = vals / widths
+    elif histnorm == "probability density":
+        vals = vals / total / widths if total else vals
+    return vals
+
+
+def _histograms_to_bars(traces: List[Any], max_points: int) -> Dict[int, Any]:
+    """
+    Pre-binned bars for histogram traces when any of them is large: same aggregate
+    (histfunc/histnorm) as plotly and one set of bin edges shared by all traces.
+    """
+    parsed = {i: _histogram_values(t) for i, t in enumerate(traces) if t.type == "histogram"}
+    if not parsed or not any(p and len(p[0]) > max_points for p in parsed.values()):
+        return {}
+    if not all(parsed.values()) or len({p[2] for p in parsed.values()}) != 1:
+        return {}  # some trace cannot be reproduced; keep all of them as histograms
+    values = np.concatenate([p[0][~np.isnan(p[0])] for p in parsed.values()])
+    if not len(values):
+        return {}
+    nbins = max((t.nbinsy if p[2] else t.nbinsx) or 0 for t, p in ((traces[i], p) for i, p in parsed.items()))
+    edges = np.histogram_bin_edges(values, bins=nbins or "auto")
+    centers, widths = (edges[:-1] + edges[1:]) / 2, np.diff(edges)
+
+    out = {}
+    for i, (arr, weights, horizontal) in parsed.items():
+        t = traces[i]
+        vals = _aggregate(arr, weights, edges, t.histfunc or "count", t.histnorm or "")
+        out[i] = go.Bar(
+            x=vals if horizontal else centers, y=centers if horizontal else vals,
+            width=widths, orientation="h" if horizontal else "v", offsetgroup=t.offsetgroup,
+            name=t.name, marker_color=t.marker.color, showlegend=t.showlegend, legendgroup=t.legendgroup,
+        )
+    return out
+
+
+def _is_ordered_axis(cats: np.ndarray) -> bool:
+    """Numbers and dates (also as strings like '2024-01') are an ordered axis, not categories."""
+    if np.issubdtype(cats.dtype, np.number) or np.issubdtype(cats.dtype, np.datetime64):
+        return True
+    values = [c for c in cats if c is not None]
+    if values and all(isinstance(c, (int, float, np.number, pd.Timestamp)) for c in values):
+        return True
+    try:
+        pd.to_datetime(pd.Series(values, dtype=str), format="mixed")
+        return True
+    except (ValueError, TypeError):
+        return False
+
+
+def _collapse_bars(trace, max_bars: int):
+    horizontal = trace.orientation == "h"
+    cats, vals = (trace.y, trace.x) if horizontal else (trace.x, trace.y)
+    if cats is None or vals is None or len(cats) <= max_bars or len(cats) != len(vals):
+        return trace
+    n = len(cats)
+    # Labels, hovers and colours are per bar and cannot be summed into «Прочее»
+    if any(_is_array(trace[attr], n) for attr in POINT_ATTRS if attr not in ("x", "y")) or any(
+        _is_array(getattr(trace.marker, attr, None), n) for attr in MARKER_ATTRS
+    ):
+        return trace
+    cats = np.asarray(cats)
+    if _is_ordered_axis(cats):
+        return trace
+    try:
+        s = pd.Series(np.asarray(vals, dtype=float), index=pd.Index(cats).astype(str))
+    except (ValueError, TypeError):
+        return trace
+    s = s.groupby(level=0, sort=False).sum()
+    if len(s) <= max_bars:
+        return trace
+    # Keep the largest categories in their original order; the rest become one bar
+    top = s.index.isin(s.nlargest(max_bars - 1).index)
+    kept = pd.concat([s[top], pd.Series({"Прочее": s[~top].sum()})])
+    cats, vals = kept.index.to_numpy(), kept.to_numpy()
+    if horizontal:
+        trace.update(y=cats, x=vals)
+    else:
+        trace.update(x=cats, y=vals)
+    return trace
+
+
+def _compact_traces(data, max_points: int, max_bars: Optional[int]) -> List[Any]:
+    bar_traces = sum(1 for t in data if t.type == "bar")
+    binned = _histograms_to_bars(list(data), max_points) if max_bars else {}
+    traces = []
+    for i, t in enumerate(data):
+        if t.type in ("scatter", "scattergl"):
+            t = _downsample_scatter(t, max_points)
+        elif i in binned:
+            t = binned[i]
+        elif t.type == "bar" and bar_traces == 1 and max_bars:
+            # Grouped/stacked bars share categories, so only a single trace is collapsed
+            t = _collapse_bars(t, max_bars)
+        traces.append(t)
+    return traces
+
+
+def compact_figure(fig: go.Figure, max_points: int = None, max_bars: int = None) -> go.Figure:
+    """Downsample long line/scatter traces and aggregate oversized bar/histogram inputs."""
+    max_points = max_points or cfg.VIZ_MAX_POINTS
+    max_bars = max_bars or cfg.VIZ_MAX_BARS
+    if fig.frames:
+        # Frames restyle the base traces, so they must keep their type and categories:
+        # only scatter traces are thinned, in the base data and in every frame
+        frames = [go.Frame(f, data=_compact_traces(f.data, max_points, None)) for f in fig.frames]
+        return go.Figure(data=_compact_traces(fig.data, max_points, None), layout=fig.layout, frames=frames)
+    return go.Figure(data=_compact_traces(fig.data, max_points, max_bars), layout=fig.layout)
+
+
+def _typed_array(values: List[Any]) -> Any:
+    if len(values) < TYPED_MIN_LEN or not all(
+        isinstance(v, (int, float)) and not isinstance(v, bool) for v in values
+    ):
+        return values
+    arr = np.asarray(values)
+    if arr.dtype.kind == "i" and np.abs(arr).max() < 2 ** 31:
+        arr, dtype = arr.astype("<i4"), "i4"
+    else:
+        arr, dtype = arr.astype("<f8"), "f8"
+    return {"dtype": dtype, "bdata": base64.b64encode(arr.tobytes()).decode("ascii")}
+
+
+def encode_typed_arrays(fig_dict: Dict[str, Any]) -> Dict[str, Any]:
+    """Replace long numeric lists in traces with plotly.js base64 typed arrays."""
+    for trace in fig_dict.get("data", []):
+        for key in TYPED_KEYS:
+            if isinstance(trace.get(key), list):
+                trace[key] = _typed_array(trace[key])
+    return fig_dict
@@ -1,13 +1,22 @@
 import os
+import time
+import uuid
+import asyncio
+import weakref
+from typing import Any, AsyncIterator, Dict, List, Optional
+from langgraph.config import get_stream_writer
 from langgraph.graph import StateGraph, START, END
 from langgraph.prebuilt import ToolNode
-from langgraph.checkpoint.memory import InMemorySaver
-from langchain_groq import ChatGroq
-from langchain_openai import ChatOpenAI
 from langchain_core.messages import AIMessage, HumanMessage
+from langchain_core.rate_limiters import InMemoryRateLimiter
 
 from backend.database import Database
+from backend.catalog import SchemaCatalog
 from backend.tools import create_tools
+from backend.sandbox import VizSandbox
+from backend.checkpoint import create_checkpointer
+from backend.context import compact_messages, CHARS_PER_TOKEN
+from backend.metrics import span, LLM_TOKENS
 from backend.state import MedicalAgentState
 from backend.config import log, cfg
 
@@ -20,7 +29,7 @@ SYSTEM_PROMPT = """You are an expert Medical Data Analyst working with a Russian
 
 ### WORKFLOW:
 1. **Discovery**: Use `search_codes` to find ICD-10 diagnosis codes (Russian text)
-2. **Analysis**: Use `execute_sql` to query the database (returns first 10 rows)
+2. **Analysis**: Use `execute_sql` to query the database (returns the first rows and the total row count)
 3. **Visualization**: Use `generate_visualization` with:
    - `sql`: SQL query for data
    - `python_code`: Python code creating `fig` (px, go, pd, np available)
@@ -36,47 +45,253 @@ SYSTEM_PROMPT = """You are an expert Medical Data Analyst working with a Russian
 """
 
 
+def _notify_stream(event: Dict[str, Any]):
+    """
+    Tell a streaming client (stream_mode "custom") which model run the answer comes from:
+    "llm_fallback" when the primary failed mid-stream, "llm_winner" with the message id
+    when a hedged call returned.
+    """
+    try:
+        get_stream_writer()(event)
+    except RuntimeError:
+        pass  # called outside a graph run
+
+
+class CircuitBreaker:
+    """Skips a model for a cool-down window after repeated consecutive failures."""
+
+    def __init__(self, name: str, max_failures: int, cooldown: float):
+        self.name = name
+        self.max_failures = max_failures
+        self.cooldown = cooldown
+        self.failures = 0
+        self.opened_at = None
+        self.probe_at = None
+
+    @property
+    def is_open(self) -> bool:
+        """Within the cool-down window."""
+        return self.opened_at is not None and time.monotonic() - self.opened_at < self.cooldown
+
+    def allow(self) -> bool:
+        """Whether to call the model now. After the cool-down (half-open) only one probe call goes through."""
+        if self.opened_at is None:
+            return True
+        now = time.monotonic()
+        if self.is_open:
+            return False
+        # A probe cancelled before reporting back (e.g. lost a hedge) expires after another cool-down
+        if self.probe_at is not None and now - self.probe_at < self.cooldown:
+            return False
+        self.probe_at = now
+        return True
+
+    def record_success(self):
+        if self.opened_at is not None:
+            log("Graph", f"{self.name} recovered, closing circuit", "G")
+        self.failures = 0
+        self.opened_at = None
+        self.probe_at = None
+
+    def record_failure(self):
+        self.failures += 1
+        if self.failures >= self.max_failures:
+            if not self.is_open:
+                log("Graph", f"{self.name} failed {self.failures}x, skipping for {self.cooldown:.0f}s", "Y")
+            self.opened_at = time.monotonic()
+            self.probe_at = None
+
+
 class MedicalGraph:
+    """
+    Construction is cheap: data, models and visualization workers are set up by
+    `start()`, which the API runs in the background so the server accepts
+    connections (and reports progress on /ready) while tables load.
+    """
+
     def __init__(self):
-        self.db = Database("data")
-        self.tools = create_tools(self.db)
-        self.checkpointer = InMemorySaver()
+        self.db = Database(cfg.DATA_DIR, load=False)
+        self.catalog = SchemaCatalog(self.db)
+        self.sandbox = VizSandbox()
+        self.tools = create_tools(self.db, self.sandbox)
+        self.checkpointer = create_checkpointer()
+        self.primary = None
+        self.fallback = None
+
+        self.breaker = CircuitBreaker("Primary model", cfg.LLM_BREAKER_FAILURES, cfg.LLM_BREAKER_COOLDOWN)
+        # Shared by every conversation and batch, so the provider sees one request rate
+        self.rate_limiter = InMemoryRateLimiter(
+            requests_per_second=cfg.LLM_RATE_LIMIT, check_every_n_seconds=0.05,
+            max_bucket_size=max(cfg.LLM_RATE_LIMIT, 1)
+        ) if cfg.LLM_RATE_LIMIT > 0 else None
+        # Per-conversation tool slots; an entry lives only while its calls are in flight
+        self._tool_slots: "weakref.WeakValueDictionary[str, asyncio.Semaphore]" = weakref.WeakValueDictionary()
+        self.graph = self._build_graph()
+        log("Graph", "Initialized with custom StateGraph", "G")
+
+    def _build_models(self):
+        # Provider SDKs are slow to import; only load them when the models are needed
+        from langchain_groq import ChatGroq
+        from langchain_openai import ChatOpenAI
 
         # Primary model (Groq)
-        self.primary = ChatGroq(
-            model="openai/gpt-oss-20b",
-            temperature=0,
-            max_retries=0
-        ).bind_tools(self.tools)
+        if self.primary is None:
+            self.primary = ChatGroq(
+                model="openai/gpt-oss-20b",
+                temperature=0,
+                max_retries=0
+            ).bind_tools(self.tools)
 
         # Fallback model (OpenRouter)
-        self.fallback = ChatOpenAI(
-            api_key=os.getenv("OPENROUTER_API_KEY"),
-            base_url="https://openrouter.ai/api/v1",
-            model="openai/gpt-oss-20b:free",
-            temperature=0
-        ).bind_tools(self.tools)
+        if self.fallback is None:
+            self.fallback = ChatOpenAI(
+                api_key=os.getenv("OPENROUTER_API_KEY"),
+                base_url="https://openrouter.ai/api/v1",
+                model="openai/gpt-oss-20b:free",
+                temperature=0
+            ).bind_tools(self.tools)
 
-        self.graph = self._build_graph()
-        log("Graph", "Initialized with custom StateGraph", "G")
+    @property
+    def models_ready(self) -> bool:
+        return self.primary is not None and self.fallback is not None
+
+    def start(self):
+        """
+        Build the LLM clients, then load data (tables usable as they finish), warm up
+        plotting workers and profile the schema so the first question does not pay for it.
+        """
+        self._build_models()
+        self.db.load()
+        self.sandbox.start()
+        self.catalog.tables()
+
+    async def _call(self, name: str, model, messages):
+        if self.rate_limiter is not None:
+            with span("llm_wait"):
+                await self.rate_limiter.aacquire()
+        with span("llm", model=name) as extra:
+            response = await model.ainvoke(messages)
+            usage = getattr(response, "usage_metadata", None) or {}
+            extra.update(tokens_in=usage.get("input_tokens", 0), tokens_out=usage.get("output_tokens", 0))
+        LLM_TOKENS.inc(extra["tokens_in"], model=name, direction="in")
+        LLM_TOKENS.inc(extra["tokens_out"], model=name, direction="out")
+        return response
+
+    async def _invoke_with_fallback(self, messages):
+        """Invoke model with fallback on error, open circuit or (optionally) slow primary."""
+        if not self.breaker.allow():
+            return await self._call("fallback", self.fallback, messages)
+
+        primary = asyncio.ensure_future(self._call("primary", self.primary, messages))
+        fallback = None
+        tasks = {primary}
+        try:
+            if cfg.LLM_HEDGE_AFTER > 0:
+                await asyncio.wait(tasks, timeout=cfg.LLM_HEDGE_AFTER)
+            else:
+                await asyncio.wait(tasks)
 
-    def _invoke_with_fallback(self, messages):
-        """Invoke model with fallback on error."""
+            if not primary.done():
+                log("Graph", f"Primary slower than {cfg.LLM_HEDGE_AFTER}s, hedging with fallback", "Y")
+                fallback = asyncio.ensure_future(self._call("fallback", self.fallback, messages))
+                tasks.add(fallback)
+
+            error = None
+            while tasks:
+                done, tasks = await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+                for t in done:
+                    if t.exception() is None:
+                        if t is primary:
+                            self.breaker.record_success()
+                        if fallback is not None:
+                            # Two runs may have streamed; the client must show the one that won
+                            _notify_stream({"event": "llm_winner", "id": t.result().id})
+                        return t.result()
+                    error = t.exception()
+                    if t is primary:
+                        self.breaker.record_failure()
+                        log("Graph", f"Primary model error: {error}, using fallback", "Y")
+                        _notify_stream({"event": "llm_fallback"})
+                        if fallback is None:
+                            fallback = asyncio.ensure_future(self._call("fallback", self.fallback, messages))
+                            tasks.add(fallback)
+            raise error
+        finally:
+            for t in tasks:
+                t.cancel()
+
+    async def answer(self, question: str, thread_id: Optional[str] = None) -> Dict[str, Any]:
+        """Run one question to the end without streaming: answer, insights, chart and thread id."""
+        thread_id = thread_id or f"batch_{uuid.uuid4()}"
+        config = {"recursion_limit": cfg.MAX_TOOL_CALLS * 2 + 1, "configurable": {"thread_id": thread_id}}
+        state = await self.graph.ainvoke({"messages": [HumanMessage(content=question)]}, config=config)
+        final = state.get("final_response") or {}
+        answer = final.get("answer") if isinstance(final, dict) else str(final)
+        if not answer:
+            # The model stopped without final_answer; use its last text
+            texts = [m.content for m in state["messages"] if isinstance(m, AIMessage) and isinstance(m.content, str)]
+            answer = next((t for t in reversed(texts) if t), "")
+        return {
+            "answer": answer,
+            "insights": final.get("insights", []) if isinstance(final, dict) else [],
+            "visualization": state.get("visualization_json"),
+            "thread_id": thread_id,
+        }
+
+    async def abatch(self, questions: List[str], concurrency: Optional[int] = None) -> AsyncIterator[Dict[str, Any]]:
+        """
+        Answer many questions, at most `concurrency` at a time, yielding each result
+        (with its `index` in `questions`) as soon as it completes. Repeated questions
+        run once; identical SQL and code searches across the batch are shared by the
+        database layer.
+        """
+        slots = asyncio.Semaphore(concurrency or cfg.BATCH_CONCURRENCY)
+        indexes: Dict[str, List[int]] = {}
+        for i, q in enumerate(questions):
+            indexes.setdefault(q, []).append(i)
+
+        async def run(question: str) -> tuple:
+            async with slots:
+                t0 = time.perf_counter()
+                try:
+                    result = await self.answer(question)
+                except Exception as e:
+                    log("Graph", f"Batch question failed: {e}", "R")
+                    result = {"error": str(e)}
+                return question, {**result, "seconds": round(time.perf_counter() - t0, 3)}
+
+        tasks = [asyncio.ensure_future(run(q)) for q in indexes]
         try:
-            return self.primary.invoke(messages)
-        except Exception as e:
-            log("Graph", f"Primary model error: {e}, using fallback", "Y")
-            return self.fallback.invoke(messages)
+            for next_done in asyncio.as_completed(tasks):
+                question, result = await next_done
+                for i in indexes[question]:
+                    yield {"index": i, "question": question, **result}
+        finally:
+            for t in tasks:
+                t.cancel()
+
+    async def _limit_tool_call(self, request, execute):
+        """Tool calls of one turn run concurrently (ToolNode gathers them), at most TOOL_CONCURRENCY at a time."""
+        thread_id = (request.runtime.config or {}).get("configurable", {}).get("thread_id", "")
+        slots = self._tool_slots.get(thread_id)
+        if slots is None:
+            slots = self._tool_slots[thread_id] = asyncio.Semaphore(cfg.TOOL_CONCURRENCY)
+        async with slots:
+            return await execute(request)
 
     def _build_graph(self):
         builder = StateGraph(MedicalAgentState)
 
-        def agent(state: MedicalAgentState) -> dict:
-            schema = self.db.get_schema()
+        async def agent(state: MedicalAgentState) -> dict:
+            questions = [m.content for m in state["messages"] if isinstance(m, HumanMessage)]
+            with span("schema"):
+                schema = await asyncio.to_thread(self.catalog.render, " ".join(str(q) for q in questions[-2:]))
             system_content = SYSTEM_PROMPT.format(schema=schema, max_calls=cfg.MAX_TOOL_CALLS)
-            messages = [{"role": "system", "content": system_content}] + state["messages"]
+            budget = max(cfg.CONTEXT_TOKEN_BUDGET - len(system_content) // CHARS_PER_TOKEN, 0)
+            history = compact_messages(state["messages"], budget)
+            messages = [{"role": "system", "content": system_content}] + history
             
-            response = self._invoke_with_fallback(messages)
+            response = await self._invoke_with_fallback(messages)
             
             updates = {"messages": [response]}
             if state["messages"] and isinstance(state["messages"][-1], HumanMessage):
@@ -94,11 +309,15 @@ class MedicalGraph:
                 return "tools"
             return END
 
+        def after_tools(state: MedicalAgentState) -> str:
+            # final_answer ends the turn; another model call would only repeat the answer
+            return END if state.get("final_response") else "agent"
+
         builder.add_node("agent", agent)
-        builder.add_node("tools", ToolNode(self.tools))
+        builder.add_node("tools", ToolNode(self.tools, awrap_tool_call=self._limit_tool_call))
         builder.add_edge(START, "agent")
         builder.add_conditional_edges("agent", route)
-        builder.add_edge("tools", "agent")
+        builder.add_conditional_edges("tools", after_tools)
 
         return builder.compile(checkpointer=self.checkpointer)
 
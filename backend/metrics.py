@@ -0,0 +1,148 @@
+import time
+import asyncio
+import threading
+from bisect import bisect_left
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Any, Dict, List, Optional, Tuple
+from backend.config import log, cfg
+
+# Seconds; covers cache hits (sub-ms) up to slow LLM calls
+BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+# Spans of the request being streamed; None outside of a request
+_spans: ContextVar[Optional[List[Dict[str, Any]]]] = ContextVar("spans", default=None)
+
+LabelKey = Tuple[Tuple[str, str], ...]
+
+
+def _labels(labels: Dict[str, Any]) -> LabelKey:
+    return tuple(sorted((k, str(v).lower() if isinstance(v, bool) else str(v)) for k, v in labels.items()))
+
+
+def _fmt(key: LabelKey, extra: str = "") -> str:
+    parts = [f'{k}="{v}"' for k, v in key] + ([extra] if extra else [])
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+class Histogram:
+    def __init__(self, name: str, help: str, buckets: Tuple[float, ...] = BUCKETS):
+        self.name = name
+        self.help = help
+        self.buckets = buckets
+        self._series: Dict[LabelKey, list] = {}   # labels -> [bucket counts..., sum, count]
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, **labels):
+        key = _labels(labels)
+        with self._lock:
+            series = self._series.setdefault(key, [0] * (len(self.buckets) + 2))
+            i = bisect_left(self.buckets, value)
+            if i < len(self.buckets):
+                series[i] += 1
+            series[-2] += value
+            series[-1] += 1
+
+    def render(self) -> List[str]:
+        out = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            for key, series in sorted(self._series.items()):
+                cumulative = 0
+                for bound, n in zip(self.buckets, series):
+                    cumulative += n
+                    le = f'le="{bound}"'
+                    out.append(f"{self.name}_bucket{_fmt(key, le)} {cumulative}")
+                le = 'le="+Inf"'
+                out.append(f"{self.name}_bucket{_fmt(key, le)} {series[-1]}")
+                out.append(f"{self.name}_sum{_fmt(key)} {series[-2]:.6f}")
+                out.append(f"{self.name}_count{_fmt(key)} {series[-1]}")
+        return out
+
+
+class Counter:
+    def __init__(self, name: str, help: str):
+        self.name = name
+        self.help = help
+        self._values: Dict[LabelKey, float] = {}
+        self._lock = threading.Lock()
+
+    def inc(self, value: float = 1, **labels):
+        key = _labels(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + value
+
+    def render(self) -> List[str]:
+        out = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            out += [f"{self.name}{_fmt(key)} {v:g}" for key, v in sorted(self._values.items())]
+        return out
+
+
+STAGE_SECONDS = Histogram("medinsight_stage_seconds", "Duration of pipeline stages")
+STAGE_ERRORS = Counter("medinsight_stage_errors_total", "Stages that raised an exception")
+LLM_TOKENS = Counter("medinsight_llm_tokens_total", "LLM tokens by model and direction")
+METRICS = [STAGE_SECONDS, STAGE_ERRORS, LLM_TOKENS]
+
+
+def record(stage: str, seconds: float, extra: Optional[Dict[str, Any]] = None, **labels):
+    """
+    Record a finished stage: histogram by `labels`, plus the request's span list
+    and (optionally) a log line carrying `extra` fields such as token counts.
+    """
+    STAGE_SECONDS.observe(seconds, stage=stage, **labels)
+    fields = {**labels, **(extra or {})}
+    spans = _spans.get()
+    if spans is not None:
+        spans.append({"stage": stage, "ms": round(seconds * 1000, 1), **fields})
+    if cfg.LOG_SPANS:
+        log("Span", stage, "GR", ms=round(seconds * 1000, 1), **fields)
+
+
+@contextmanager
+def span(stage: str, **labels):
+    """Time a block; the yielded dict collects extra fields for the span (not metric labels)."""
+    extra: Dict[str, Any] = {}
+    t0 = time.perf_counter()
+    try:
+        yield extra
+    except asyncio.CancelledError:
+        extra["cancelled"] = True
+        raise
+    except BaseException:
+        STAGE_ERRORS.inc(stage=stage)
+        extra["error"] = True
+        raise
+    finally:
+        record(stage, time.perf_counter() - t0, extra, **labels)
+
+
+def start_request() -> List[Dict[str, Any]]:
+    """Begin collecting spans for the current request (context-local)."""
+    spans: List[Dict[str, Any]] = []
+    _spans.set(spans)
+    return spans
+
+
+def drain(spans: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """Spans recorded since the last drain."""
+    out = spans[:]
+    del spans[:len(out)]
+    return out
+
+
+def _gauges(prefix: str, stats: Dict[str, Any]) -> List[str]:
+    out = []
+    for k, v in stats.items():
+        if isinstance(v, dict):
+            out += _gauges(f"{prefix}_{k}", v)
+        elif isinstance(v, (int, float)) and not isinstance(v, bool):
+            out += [f"# TYPE {prefix}_{k} gauge", f"{prefix}_{k} {v:g}"]
+    return out
+
+
+def render(stats: Optional[Dict[str, Dict[str, Any]]] = None) -> str:
+    """Prometheus text format: stage histograms, counters and numeric component stats as gauges."""
+    lines = [line for m in METRICS for line in m.render()]
+    for name, values in (stats or {}).items():
+        lines += _gauges(f"medinsight_{name}", values)
+    return "\n".join(lines) + "\n"
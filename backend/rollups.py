@@ -0,0 +1,179 @@
+import re
+import json
+import time
+from typing import Any, Dict, List, Optional, Tuple
+from backend.config import log, cfg
+
+ROLLUP_PREFIX = "rollup_"
+DATE_TYPES = ("DATE", "TIMESTAMP", "TIMESTAMP WITH TIME ZONE")
+SKIP_TYPES = ("FLOAT", "DOUBLE", "BLOB")
+
+# Tokens of the query shapes the router understands; anything else disables rewriting
+TOKEN_RE = re.compile(r"""\s+|'(?:[^']|'')*'|"[^"]+"|[A-Za-z_][A-Za-z0-9_]*|\d+(?:\.\d+)?|<=|>=|<>|!=|[(),*=<>]""")
+KEYWORDS = {
+    "select", "from", "where", "group", "by", "order", "having", "limit", "as", "and", "or",
+    "not", "in", "is", "null", "asc", "desc", "all", "like", "ilike", "between", "nulls", "first", "last",
+    "count", "date_trunc", "year", "month", "quarter", "true", "false",
+}
+COUNT_RE = re.compile(r"\bcount\s*\(\s*(?:\*|1)\s*\)", re.I)
+# Date functions whose result is the same on the first day of the month
+MONTH_SAFE_RE = r"(?:date_trunc\s*\(\s*'(?:month|quarter|year)'\s*,\s*{col}\s*\)|(?:year|quarter|month)\s*\(\s*{col}\s*\))"
+
+
+def _ident(token: str) -> str:
+    return token[1:-1] if token.startswith('"') else token.lower()
+
+
+def _create_registry(conn):
+    conn.execute("CREATE SCHEMA IF NOT EXISTS meta")
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS meta.rollups (
+            name VARCHAR PRIMARY KEY, source VARCHAR, dims VARCHAR, months VARCHAR, rows BIGINT
+        )
+    """)
+
+
+def drop_rollup(conn, table: str):
+    _create_registry(conn)
+    conn.execute(f"DROP TABLE IF EXISTS {ROLLUP_PREFIX}{table}")
+    conn.execute("DELETE FROM meta.rollups WHERE source = ?", [table])
+
+
+def build_rollup(conn, table: str) -> Optional[Dict[str, Any]]:
+    """
+    (Re)build the count rollup of a large table over its low-cardinality columns
+    and the month of each date column. Returns the registry entry or None if the
+    table is too small or has nothing worth grouping by.
+    """
+    drop_rollup(conn, table)
+    summary = conn.execute(f"SUMMARIZE {table}").fetchall()
+    rows = summary[0][10] if summary else 0
+    if rows < cfg.ROLLUP_MIN_ROWS:
+        return None
+
+    months = [c[0] for c in summary if c[1] in DATE_TYPES]
+    dims = sorted(
+        (c for c in summary if c[1] not in DATE_TYPES and not c[1].startswith(SKIP_TYPES)
+         and c[4] and c[4] <= cfg.ROLLUP_MAX_CARDINALITY),
+        key=lambda c: c[4],
+    )
+    dims = [c[0] for c in dims]
+
+    name = f"{ROLLUP_PREFIX}{table}"
+    t0 = time.time()
+    # Drop the highest-cardinality dimension until the rollup is small enough to pay off
+    while dims or months:
+        select = [f'"{d}"' for d in dims] + [f"date_trunc('month', \"{m}\") AS \"{m}_month\"" for m in months]
+        conn.execute(f"""
+            CREATE OR REPLACE TABLE {name} AS
+            SELECT {', '.join(select)}, count(*) AS cnt FROM {table} GROUP BY ALL
+        """)
+        size = conn.execute(f"SELECT count(*) FROM {name}").fetchone()[0]
+        if size <= rows * cfg.ROLLUP_MAX_RATIO:
+            break
+        if dims:
+            dims.pop()
+        else:
+            months.pop()
+    else:
+        conn.execute(f"DROP TABLE IF EXISTS {name}")
+        return None
+
+    conn.execute("INSERT OR REPLACE INTO meta.rollups VALUES (?, ?, ?, ?, ?)",
+                 [name, table, json.dumps(dims), json.dumps(months), size])
+    log("Rollup", f"Built '{name}': {rows} -> {size} rows over {dims + [m + '_month' for m in months]} "
+                  f"in {time.time() - t0:.1f}s", "G")
+    return {"name": name, "source": table, "dims": dims, "months": months, "rows": size}
+
+
+def read_rollups(conn) -> Dict[str, List[Dict[str, Any]]]:
+    """Registry of built rollups: source table -> rollup entries; empty when ROLLUPS is off."""
+    if not cfg.ROLLUPS:
+        return {}
+    try:
+        rows = conn.execute("SELECT name, source, dims, months, rows FROM meta.rollups").fetchall()
+    except Exception:
+        return {}
+    out: Dict[str, List[Dict[str, Any]]] = {}
+    for name, source, dims, months, size in rows:
+        out.setdefault(source, []).append(
+            {"name": name, "source": source, "dims": json.loads(dims), "months": json.loads(months), "rows": size})
+    return out
+
+
+class RollupRouter:
+    """
+    Rewrites single-table COUNT(*) queries to SUM(cnt) over the smallest rollup
+    that covers every column the query touches. Only a narrow, verifiable query
+    shape is rewritten; everything else runs against the raw table.
+    """
+
+    def __init__(self, rollups: Dict[str, List[Dict[str, Any]]]):
+        self.rollups = rollups
+        self.rewrites = 0
+
+    def rewrite(self, sql: str) -> Optional[Tuple[str, str]]:
+        """(rewritten sql, rollup name) or None if the query must run on the source table."""
+        if not self.rollups or not COUNT_RE.search(sql):
+            return None
+        pos, tokens = 0, []
+        while pos < len(sql):
+            m = TOKEN_RE.match(sql, pos)
+            if not m:
+                return None
+            if not m.group().isspace():
+                tokens.append(m.group())
+            pos = m.end()
+
+        lower = [t.lower() for t in tokens]
+        if lower[0] != "select" or lower.count("from") != 1 or lower.count("select") != 1:
+            return None
+        idx = lower.index("from")
+        if idx + 1 >= len(tokens):
+            return None
+        table = _ident(tokens[idx + 1])
+        if idx + 2 < len(tokens) and lower[idx + 2] not in ("where", "group", "order", "limit"):
+            return None  # joins, table aliases, set operations
+
+        aliases = {_ident(tokens[i + 1]) for i, t in enumerate(lower[:-1]) if t == "as"}
+        used = set()
+        for i, t in enumerate(tokens):
+            if i == idx + 1 or t[0] in "'(),*=<>" or t[0].isdigit():
+                continue
+            ident = _ident(t)
+            if t[0] != '"' and ident in KEYWORDS:
+                continue
+            used.add(ident)
+        used -= aliases
+
+        # count(x) counts non-nulls of a column, which a rollup cannot answer
+        stripped = COUNT_RE.sub("", sql)
+        if re.search(r"\b(count|sum)\s*\(", stripped, re.I):
+            return None
+
+        for rollup in sorted(self.rollups.get(table, []), key=lambda r: r["rows"]):
+            out = self._apply(sql, rollup, used)
+            if out:
+                return out, rollup["name"]
+        return None
+
+    def _apply(self, sql: str, rollup: Dict[str, Any], used: set) -> Optional[str]:
+        dims = {d.lower() for d in rollup["dims"]}
+        months = {m.lower(): m for m in rollup["months"]}
+        if not {u.lower() for u in used} <= dims | set(months):
+            return None
+        out = sql
+        for col in (months[u.lower()] for u in used if u.lower() in months):
+            quoted = rf'(?:"{re.escape(col)}"|\b{re.escape(col)}\b)'
+            safe = re.compile(MONTH_SAFE_RE.format(col=quoted), re.I)
+            # Raw date values (filters, day grain) are not preserved by the month rollup
+            if re.search(quoted, safe.sub("", out), re.I):
+                return None
+            out = safe.sub(lambda m: re.sub(quoted, f'"{col}_month"', m.group(), flags=re.I), out)
+        # SUM over no rows is NULL where count(*) is 0
+        out = COUNT_RE.sub("COALESCE(CAST(SUM(cnt) AS BIGINT), 0)", out)
+        return re.sub(rf'\bfrom\s+("?){re.escape(rollup["source"])}\1(?=\s|$)',
+                      f'FROM {rollup["name"]}', out, count=1, flags=re.I)
+
+    def stats(self) -> Dict[str, Any]:
+        return {"tables": sum(len(v) for v in self.rollups.values()), "rewrites": self.rewrites}
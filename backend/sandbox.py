@@ -0,0 +1,193 @@
+import json
+import time
+import queue
+import asyncio
+import resource
+import traceback
+import multiprocessing as mp
+from typing import Any, Dict, Optional, Tuple
+from backend.metrics import span, record
+from backend.config import log, cfg
+
+SAFE_BUILTINS = {
+    "len": len, "str": str, "int": int, "float": float, "bool": bool,
+    "list": list, "dict": dict, "range": range, "enumerate": enumerate,
+    "sum": sum, "min": min, "max": max, "abs": abs, "round": round,
+    "sorted": sorted, "zip": zip, "True": True, "False": False, "None": None
+}
+
+
+def clean_code(python_code: str) -> str:
+    """Strip markdown fences and import lines from LLM-written plotting code."""
+    code = python_code.strip()
+    for prefix in ["```python\n", "```\n", "python\n"]:
+        if code.startswith(prefix):
+            code = code[len(prefix):]
+    code = code.rstrip("`").strip()
+    return "\n".join(l for l in code.split("\n") if not l.strip().startswith("import "))
+
+
+def _to_payload(data) -> Any:
+    """Arrow IPC bytes for the worker; falls back to the DataFrame itself (pickled)."""
+    import pyarrow as pa
+    if isinstance(data, pa.Table):
+        table = data
+    else:
+        try:
+            table = pa.Table.from_pandas(data, preserve_index=False)
+        except (pa.ArrowInvalid, pa.ArrowTypeError):
+            return data
+    sink = pa.BufferOutputStream()
+    with pa.ipc.new_stream(sink, table.schema) as writer:
+        writer.write_table(table)
+    return sink.getvalue().to_pybytes()
+
+
+def _render(payload: Any, code: str, cpu_seconds: int) -> Tuple[Optional[Dict[str, Any]], Optional[str], Dict[str, float]]:
+    """(figure dict, error, stage timings in seconds) for one chart, run inside a worker."""
+    import pyarrow as pa
+    import pandas as pd
+    import numpy as np
+    import plotly.express as px
+    import plotly.graph_objects as go
+    from backend.figures import compact_figure, encode_typed_arrays
+
+    if cpu_seconds:
+        usage = resource.getrusage(resource.RUSAGE_SELF)
+        _, hard = resource.getrlimit(resource.RLIMIT_CPU)
+        resource.setrlimit(resource.RLIMIT_CPU, (int(usage.ru_utime + usage.ru_stime) + cpu_seconds, hard))
+
+    timings = {}
+    try:
+        t0 = time.perf_counter()
+        if isinstance(payload, bytes):
+            # The stream is read in place; pandas gets one block per column and frees Arrow memory as it goes
+            table = pa.ipc.open_stream(pa.py_buffer(payload)).read_all()
+            df = table.to_pandas(split_blocks=True, self_destruct=True)
+            del table
+        else:
+            df = payload
+        exec_globals = {"df": df, "px": px, "go": go, "pd": pd, "np": np, "__builtins__": SAFE_BUILTINS}
+        exec_locals = {}
+        t1 = time.perf_counter()
+        exec(code, exec_globals, exec_locals)
+        timings["viz_load"], timings["viz_exec"] = t1 - t0, time.perf_counter() - t1
+
+        fig = exec_locals.get('fig') or exec_globals.get('fig')
+        if not isinstance(fig, go.Figure):
+            return None, "Code must create 'fig' variable", timings
+        t0 = time.perf_counter()
+        out = encode_typed_arrays(json.loads(compact_figure(fig).to_json()))
+        timings["viz_serialize"] = time.perf_counter() - t0
+        return out, None, timings
+    except Exception:
+        return None, f"Error: {traceback.format_exc()}", timings
+
+
+def _worker_main(conn, memory_mb: int):
+    if memory_mb:
+        _, hard = resource.getrlimit(resource.RLIMIT_AS)
+        resource.setrlimit(resource.RLIMIT_AS, (memory_mb * 1024 * 1024, hard))
+    # Pre-warm heavy imports so the first chart does not pay for them
+    import pyarrow, pandas, numpy, plotly.express, plotly.graph_objects  # noqa: F401
+    import backend.figures  # noqa: F401
+
+    while True:
+        try:
+            payload, code, cpu_seconds = conn.recv()
+        except (EOFError, OSError):
+            return
+        conn.send(_render(payload, code, cpu_seconds))
+
+
+class _Worker:
+    def __init__(self, ctx, memory_mb: int):
+        self.conn, child = ctx.Pipe()
+        self.proc = ctx.Process(target=_worker_main, args=(child, memory_mb), daemon=True)
+        self.proc.start()
+        child.close()
+
+    def kill(self):
+        self.proc.kill()
+        self.proc.join(timeout=1)
+        self.conn.close()
+
+
+class VizSandbox:
+    """
+    Pool of pre-warmed worker processes that run generated plotting code.
+    Each render is bounded by a wall-clock timeout, a CPU-time limit and an
+    address-space limit; a worker that times out, crashes or whose caller is
+    cancelled is killed and replaced.
+    """
+
+    def __init__(self, workers: int = None, timeout: float = None, memory_mb: int = None, cpu_seconds: int = None):
+        self.workers = workers or cfg.VIZ_WORKERS
+        self.timeout = timeout or cfg.VIZ_TIMEOUT
+        self.memory_mb = cfg.VIZ_MEMORY_MB if memory_mb is None else memory_mb
+        self.cpu_seconds = cfg.VIZ_CPU_SECONDS if cpu_seconds is None else cpu_seconds
+        self._ctx = mp.get_context("spawn")
+        self._idle: "queue.Queue[_Worker]" = queue.Queue()
+        self._started = False
+
+    def start(self):
+        if self._started:
+            return
+        for _ in range(self.workers):
+            self._idle.put(_Worker(self._ctx, self.memory_mb))
+        self._started = True
+        log("Sandbox", f"Started {self.workers} visualization workers", "G")
+
+    def close(self):
+        while not self._idle.empty():
+            self._idle.get_nowait().kill()
+        self._started = False
+
+    def stats(self) -> Dict[str, Any]:
+        return {"workers": self.workers, "idle": self._idle.qsize(), "started": self._started}
+
+    def _exchange(self, worker: _Worker, task: tuple):
+        worker.conn.send(task)
+        if not worker.conn.poll(self.timeout):
+            raise TimeoutError
+        return worker.conn.recv()
+
+    async def render(self, data, python_code: str) -> Tuple[Optional[Dict[str, Any]], Optional[str]]:
+        """
+        Plots an Arrow table (or DataFrame) available to the code as `df`.
+        Returns (figure dict, error string) - exactly one of them is set.
+        """
+        self.start()
+        with span("to_ipc"):
+            payload = _to_payload(data)
+        code = clean_code(python_code)
+
+        # Poll instead of blocking a thread on the queue so cancellation cannot leak a worker
+        while True:
+            try:
+                worker = self._idle.get_nowait()
+                break
+            except queue.Empty:
+                await asyncio.sleep(0.05)
+
+        healthy = False
+        t0 = time.time()
+        try:
+            with span("viz"):
+                fig, err, timings = await asyncio.to_thread(self._exchange, worker, (payload, code, self.cpu_seconds))
+            healthy = True
+            for stage, seconds in timings.items():
+                record(stage, seconds)
+        except TimeoutError:
+            return None, f"Visualization timed out after {self.timeout:.0f}s. Aggregate the data or simplify the chart."
+        except (EOFError, OSError):
+            return None, "Visualization worker crashed (CPU or memory limit exceeded). Reduce the data size."
+        finally:
+            if healthy:
+                self._idle.put(worker)
+            else:
+                log("Sandbox", f"Replacing worker after {time.time() - t0:.1f}s", "Y")
+                worker.kill()
+                self._idle.put(_Worker(self._ctx, self.memory_mb))
+
+        return fig, err
@@ -0,0 +1,131 @@
+import re
+from bisect import bisect_left
+from collections import defaultdict
+from typing import Dict, List, Tuple, Iterable
+
+NON_WORD_RE = re.compile(r"[^0-9a-zа-я]+")
+CYRILLIC_RE = re.compile(r"[а-я]")
+
+# Russian inflectional endings, longest first (light stemming, Snowball-style)
+ENDINGS = sorted([
+    "иями", "ями", "ами", "ией", "ием", "иях", "ого", "его", "ому", "ему", "ыми", "ими",
+    "ях", "ах", "ов", "ев", "ей", "ий", "ый", "ой", "ая", "яя", "ое", "ее", "ые", "ие",
+    "ых", "их", "ую", "юю", "ом", "ем", "ам", "ям", "ия", "ию", "ии", "ым", "им",
+    "ы", "и", "а", "я", "о", "е", "у", "ю", "ь", "й",
+], key=len, reverse=True)
+
+MIN_STEM = 3
+FUZZY_THRESHOLD = 0.35
+
+
+def normalize(text: str) -> str:
+    return NON_WORD_RE.sub(" ", str(text).lower().replace("ё", "е")).strip()
+
+
+def stem(word: str) -> str:
+    if not CYRILLIC_RE.search(word):
+        return word
+    for end in ENDINGS:
+        if word.endswith(end) and len(word) - len(end) >= MIN_STEM:
+            return word[:-len(end)]
+    return word
+
+
+def trigrams(term: str) -> set:
+    padded = f" {term} "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+class SearchIndex:
+    """
+    In-memory index over (code, name) pairs of a dictionary table.
+    Serves exact and prefix code lookups, stemmed word matches and
+    trigram-based fuzzy matches in a single ranked pass.
+    """
+
+    def __init__(self, rows: Iterable[Tuple[str, str]]):
+        self.codes: List[str] = []
+        self.names: List[str] = []
+        self._by_code: Dict[str, List[int]] = defaultdict(list)
+        self._postings: Dict[str, set] = defaultdict(set)   # stem -> row ids
+        self._grams: Dict[str, set] = defaultdict(set)      # trigram -> stems
+        self._gram_count: Dict[str, int] = {}               # stem -> number of trigrams
+
+        for i, (code, name) in enumerate(rows):
+            code, name = str(code or ""), str(name or "")
+            self.codes.append(code)
+            self.names.append(name)
+            self._by_code[code.upper()].append(i)
+            for word in normalize(name).split():
+                self._postings[stem(word)].add(i)
+
+        for term in self._postings:
+            grams = trigrams(term)
+            self._gram_count[term] = len(grams)
+            for g in grams:
+                self._grams[g].add(term)
+        self._sorted_codes = sorted(self._by_code)
+
+    def __len__(self) -> int:
+        return len(self.codes)
+
+    def _match_codes(self, keyword: str, scores: Dict[int, float]):
+        kw = keyword.strip().upper()
+        if not kw:
+            return
+        for i in self._by_code.get(kw, []):
+            scores[i] = max(scores.get(i, 0.0), 3.0)
+        pos = bisect_left(self._sorted_codes, kw)
+        while pos < len(self._sorted_codes) and self._sorted_codes[pos].startswith(kw):
+            for i in self._by_code[self._sorted_codes[pos]]:
+                scores[i] = max(scores.get(i, 0.0), 2.0)
+            pos += 1
+
+    def _match_term(self, term: str) -> Dict[int, float]:
+        """Rows containing the term exactly (1.0) or a similar term (trigram Jaccard)."""
+        hits = {i: 1.0 for i in self._postings.get(term, ())}
+        grams = trigrams(term)
+        counts: Dict[str, int] = defaultdict(int)
+        for g in grams:
+            for cand in self._grams.get(g, ()):
+                counts[cand] += 1
+        for cand, common in counts.items():
+            if cand == term:
+                continue
+            sim = common / (len(grams) + self._gram_count[cand] - common)
+            if sim < FUZZY_THRESHOLD:
+                continue
+            for i in self._postings[cand]:
+                if hits.get(i, 0.0) < sim:
+                    hits[i] = sim
+        return hits
+
+    def search(self, keyword: str) -> Dict[int, float]:
+        """Row id -> score for one keyword (code, word or phrase)."""
+        scores: Dict[int, float] = {}
+        self._match_codes(keyword, scores)
+
+        terms = [stem(w) for w in normalize(keyword).split() if len(w) >= 2]
+        if terms:
+            text_scores: Dict[int, float] = defaultdict(float)
+            for term in terms:
+                for i, s in self._match_term(term).items():
+                    text_scores[i] += s / len(terms)
+            phrase = normalize(keyword)
+            for i, s in text_scores.items():
+                if len(terms) > 1 and phrase in normalize(self.names[i]):
+                    s += 0.5
+                scores[i] = max(scores.get(i, 0.0), s)
+        return scores
+
+    def search_many(self, keywords: List[str], limit: int = 20) -> List[Tuple[str, str, float, List[str]]]:
+        """Merged ranking for many keywords: (code, name, score, matched keywords)."""
+        merged: Dict[int, float] = {}
+        matched: Dict[int, List[str]] = defaultdict(list)
+        for kw in keywords:
+            for i, s in self.search(kw).items():
+                merged[i] = max(merged.get(i, 0.0), s)
+                matched[i].append(kw)
+        # Rows matched by several keywords rank higher; shorter names win ties
+        ranked = sorted(merged, key=lambda i: (-(merged[i] + 0.1 * (len(matched[i]) - 1)), len(self.names[i])))
+        return [(self.codes[i], self.names[i], round(merged[i], 2), matched[i]) for i in ranked[:limit]]
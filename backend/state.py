@@ -2,7 +2,12 @@ from typing import Annotated, Optional, Dict, Any
 from langgraph.graph.message import add_messages
 from langgraph.prebuilt.chat_agent_executor import AgentState
 
+def last_value(old, new):
+    """Reducer that lets several tools of one turn write the same key; the last write wins."""
+    return new
+
+
 class MedicalAgentState(AgentState):
     """Extended agent state with visualization support."""
-    visualization_json: Optional[Dict[str, Any]] = None
+    visualization_json: Annotated[Optional[Dict[str, Any]], last_value] = None
     final_response: Optional[Dict[str, Any]] = None
@@ -1,17 +1,15 @@
-import json
 import traceback
 import pandas as pd
-import numpy as np
-import plotly.graph_objects as go
-import plotly.express as px
 from typing import List, Literal, Annotated
 from pydantic import BaseModel, Field
 from langchain_core.tools import tool, InjectedToolCallId
 from langchain_core.messages import ToolMessage
 from langgraph.types import Command
 from langgraph.prebuilt import InjectedState
-from backend.database import Database
-from backend.config import log
+from backend.database import Database, FTS_INDEXES
+from backend.sandbox import VizSandbox
+from backend.metrics import span
+from backend.config import log, cfg
 
 
 class SearchCodesInput(BaseModel):
@@ -24,119 +22,80 @@ class FinalAnswerInput(BaseModel):
     insights: List[str] = Field(default_factory=list, description="Key insights")
 
 
-def create_tools(db: Database):
+def create_tools(db: Database, sandbox: VizSandbox):
     @tool("search_codes", args_schema=SearchCodesInput)
-    def search_codes(table: str, keywords: List[str]) -> str:
-        """Search for diagnosis or drug codes using FTS and fuzzy matching."""
-        try:
-            log("Tool", f"search_codes: {table}, {keywords}", "C")
-            df_desc, err = db.execute(f"DESCRIBE {table}")
-            if err:
-                return f"DB Error: {err}"
-
-            cols = df_desc['column_name'].tolist()
-            col_id = "diagnosis_code" if "diagnosis_code" in cols else "drug_code"
-            col_text = "diagnosis_name" if "diagnosis_name" in cols else "full_name"
-
-            valid_kw = [k for k in keywords if len(k) >= 1]
-            if not valid_kw:
-                return "Error: Keywords too short."
-
-            results = []
-            search_q = " ".join(valid_kw).replace("'", "")
-
-            # FTS search
-            sql_fts = f"""
-                SELECT {col_id}, {col_text}, fts_main_{table}.match_bm25({col_id}, ?) AS score
-                FROM {table} WHERE score IS NOT NULL ORDER BY score DESC LIMIT 20
-            """
-            df_fts, _ = db.execute(sql_fts, [search_q])
-            if df_fts is not None and not df_fts.empty:
-                results.append(f"FTS Matches:\n{df_fts.to_string(index=False)}")
-
-            # Fuzzy search
-            conditions, params = [], []
-            for kw in valid_kw:
-                sub = [f"{col_text} ILIKE ?", f"{col_id} ILIKE ?"]
-                params.extend([f"%{kw}%", f"{kw}%"])
-                if len(kw) > 3:
-                    sub.append(f"levenshtein({col_text}, ?) <= 3")
-                    params.append(kw)
-                conditions.append(f"({' OR '.join(sub)})")
-
-            sql_fuzzy = f"SELECT {col_id}, {col_text} FROM {table} WHERE {' OR '.join(conditions)} LIMIT 20"
-            df_fuzzy, _ = db.execute(sql_fuzzy, params)
-            if df_fuzzy is not None and not df_fuzzy.empty:
-                results.append(f"Fuzzy Matches:\n{df_fuzzy.to_string(index=False)}")
-
-            return "\n\n".join(results) if results else "No records found."
-        except Exception:
-            return f"Error: {traceback.format_exc()}"
+    async def search_codes(table: str, keywords: List[str]) -> str:
+        """Search for diagnosis or drug codes: exact/prefix codes, stemmed words and fuzzy matching."""
+        with span("tool", tool="search_codes"):
+            try:
+                log("Tool", f"search_codes: {table}, {keywords}", "C")
+                valid_kw = [k for k in keywords if len(k.strip()) >= 1]
+                if not valid_kw:
+                    return "Error: Keywords too short."
+
+                hits = await db.asearch(table, valid_kw, 20)
+                if hits is None:
+                    return f"Error: Table '{table}' is not loaded."
+                if not hits:
+                    return "No records found."
+
+                col_id, col_text = FTS_INDEXES[table]
+                df = pd.DataFrame(
+                    [(code, name, score, ", ".join(kws)) for code, name, score, kws in hits],
+                    columns=[col_id, col_text, "score", "matched"]
+                )
+                return f"Matches:\n{df.to_string(index=False)}"
+            except Exception:
+                return f"Error: {traceback.format_exc()}"
 
     @tool("execute_sql")
-    def execute_sql(
+    async def execute_sql(
         sql: Annotated[str, "Valid DuckDB SQL query"],
         tool_call_id: Annotated[str, InjectedToolCallId]
     ) -> Command:
         """Execute SQL and return preview."""
-        try:
-            log("Tool", f"execute_sql: {sql[:150]}...", "C")
-            df, err = db.execute(sql)
-            if err:
-                return Command(update={"messages": [ToolMessage(f"SQL Error: {err}", tool_call_id=tool_call_id)]})
-            if df is None or df.empty:
-                return Command(update={"messages": [ToolMessage("Empty result", tool_call_id=tool_call_id)]})
-
-            preview = f"Rows: {len(df)}. Cols: {list(df.columns)}\n{df.head(10).to_string(index=False)}"
-            return Command(update={"messages": [ToolMessage(preview, tool_call_id=tool_call_id)]})
-        except Exception:
-            return Command(update={"messages": [ToolMessage(f"Error: {traceback.format_exc()}", tool_call_id=tool_call_id)]})
+        with span("tool", tool="execute_sql"):
+            try:
+                log("Tool", f"execute_sql: {sql[:150]}...", "C")
+                df, err = await db.apreview(sql, cfg.SQL_PREVIEW_ROWS)
+                if err:
+                    return Command(update={"messages": [ToolMessage(f"SQL Error: {err}", tool_call_id=tool_call_id)]})
+                if df is None or df.empty:
+                    return Command(update={"messages": [ToolMessage("Empty result", tool_call_id=tool_call_id)]})
+
+                preview = f"Rows: {df.attrs['total_rows']}. Cols: {list(df.columns)}\n{df.to_string(index=False)}"
+                if "warning" in df.attrs:
+                    preview = f"{df.attrs['warning']}\n{preview}"
+                return Command(update={"messages": [ToolMessage(preview, tool_call_id=tool_call_id)]})
+            except Exception:
+                return Command(update={"messages": [ToolMessage(f"Error: {traceback.format_exc()}", tool_call_id=tool_call_id)]})
 
     @tool("generate_visualization")
-    def generate_visualization(
+    async def generate_visualization(
         sql: Annotated[str, "SQL query for data"],
         python_code: Annotated[str, "Python code creating Plotly fig. df=query results"],
         tool_call_id: Annotated[str, InjectedToolCallId]
     ) -> Command:
         """Generate Plotly chart from SQL data."""
-        try:
-            log("Tool", "generate_visualization", "C")
-            df, err = db.execute(sql)
-            if err:
-                return Command(update={"messages": [ToolMessage(f"SQL Error: {err}", tool_call_id=tool_call_id)]})
-            if df is None or df.empty:
-                return Command(update={"messages": [ToolMessage("No data for visualization", tool_call_id=tool_call_id)]})
-
-            # Clean code
-            code = python_code.strip()
-            for prefix in ["```python\n", "```\n", "python\n"]:
-                if code.startswith(prefix):
-                    code = code[len(prefix):]
-            code = code.rstrip("`").strip()
-            code = "\n".join(l for l in code.split("\n") if not l.strip().startswith("import "))
-
-            exec_globals = {
-                "df": df, "px": px, "go": go, "pd": pd, "np": np,
-                "__builtins__": {
-                    "len": len, "str": str, "int": int, "float": float, "bool": bool,
-                    "list": list, "dict": dict, "range": range, "enumerate": enumerate,
-                    "sum": sum, "min": min, "max": max, "abs": abs, "round": round,
-                    "sorted": sorted, "zip": zip, "True": True, "False": False, "None": None
-                }
-            }
-            exec_locals = {}
-            exec(code, exec_globals, exec_locals)
-
-            fig = exec_locals.get('fig') or exec_globals.get('fig')
-            if not isinstance(fig, go.Figure):
-                return Command(update={"messages": [ToolMessage("Code must create 'fig' variable", tool_call_id=tool_call_id)]})
-
-            return Command(update={
-                "visualization_json": json.loads(fig.to_json()),
-                "messages": [ToolMessage("Visualization created.", tool_call_id=tool_call_id)]
-            })
-        except Exception:
-            return Command(update={"messages": [ToolMessage(f"Error: {traceback.format_exc()}", tool_call_id=tool_call_id)]})
+        with span("tool", tool="generate_visualization"):
+            try:
+                log("Tool", "generate_visualization", "C")
+                table, err = await db.aexecute_arrow(sql, max_rows=cfg.SQL_MAX_RESULT_ROWS or None)
+                if err:
+                    return Command(update={"messages": [ToolMessage(f"SQL Error: {err}", tool_call_id=tool_call_id)]})
+                if table is None or table.num_rows == 0:
+                    return Command(update={"messages": [ToolMessage("No data for visualization", tool_call_id=tool_call_id)]})
+
+                fig, err = await sandbox.render(table, python_code)
+                if err:
+                    return Command(update={"messages": [ToolMessage(err, tool_call_id=tool_call_id)]})
+
+                return Command(update={
+                    "visualization_json": fig,
+                    "messages": [ToolMessage("Visualization created.", tool_call_id=tool_call_id)]
+                })
+            except Exception:
+                return Command(update={"messages": [ToolMessage(f"Error: {traceback.format_exc()}", tool_call_id=tool_call_id)]})
 
     @tool("final_answer", args_schema=FinalAnswerInput)
     def final_answer(
@@ -0,0 +1,53 @@
+import os
+import numpy as np
+import pandas as pd
+
+DIAGNOSES = [
+    ("E10", "Сахарный диабет 1 типа"), ("E11", "Сахарный диабет 2 типа"),
+    ("I10", "Эссенциальная гипертензия"), ("I11", "Гипертензивная болезнь сердца"),
+    ("I20", "Стенокардия"), ("I21", "Острый инфаркт миокарда"), ("I63", "Инфаркт мозга"),
+    ("J18", "Пневмония без уточнения возбудителя"), ("J45", "Астма"), ("J44", "Хроническая обструктивная болезнь легких"),
+    ("K29", "Гастрит и дуоденит"), ("K80", "Желчнокаменная болезнь"), ("M54", "Дорсалгия"),
+    ("N18", "Хроническая болезнь почек"), ("F32", "Депрессивный эпизод"), ("C50", "Злокачественное новообразование молочной железы"),
+]
+DRUGS = [
+    ("D01", "Метформин 500 мг"), ("D02", "Инсулин гларгин"), ("D03", "Лизиноприл 10 мг"),
+    ("D04", "Амлодипин 5 мг"), ("D05", "Аторвастатин 20 мг"), ("D06", "Ацетилсалициловая кислота 100 мг"),
+    ("D07", "Сальбутамол аэрозоль"), ("D08", "Будесонид 200 мкг"), ("D09", "Омепразол 20 мг"),
+    ("D10", "Амоксициллин 500 мг"), ("D11", "Диклофенак 50 мг"), ("D12", "Сертралин 50 мг"),
+]
+REGIONS = ["Москва", "Санкт-Петербург", "Казань", "Новосибирск", "Екатеринбург", "Омск", "Самара", "Уфа"]
+
+
+def generate(out_dir: str, rows: int = 100_000, seed: int = 0) -> dict:
+    """Write diagnoses/drugs dictionaries and visits/prescriptions fact CSVs; returns row counts."""
+    os.makedirs(out_dir, exist_ok=True)
+    rng = np.random.default_rng(seed)
+    pd.DataFrame(DIAGNOSES, columns=["diagnosis_code", "diagnosis_name"]).to_csv(
+        os.path.join(out_dir, "diagnoses.csv"), index=False)
+    pd.DataFrame(DRUGS, columns=["drug_code", "full_name"]).to_csv(
+        os.path.join(out_dir, "drugs.csv"), index=False)
+
+    patients = max(rows // 5, 1)
+    codes = np.array([c for c, _ in DIAGNOSES])
+    # Skewed code frequencies, like real morbidity
+    weights = 1 / np.arange(1, len(codes) + 1)
+    visits = pd.DataFrame({
+        "patient_id": rng.integers(0, patients, rows),
+        "diagnosis_code": rng.choice(codes, rows, p=weights / weights.sum()),
+        "visit_date": pd.Timestamp("2022-01-01") + pd.to_timedelta(rng.integers(0, 3 * 365, rows), unit="D"),
+        "region": rng.choice(REGIONS, rows),
+        "gender": rng.choice(["M", "F"], rows),
+        "age": rng.integers(0, 95, rows),
+    })
+    visits.to_csv(os.path.join(out_dir, "visits.csv"), index=False)
+
+    n_rx = rows // 2
+    prescriptions = pd.DataFrame({
+        "patient_id": rng.integers(0, patients, n_rx),
+        "drug_code": rng.choice([c for c, _ in DRUGS], n_rx),
+        "prescription_date": pd.Timestamp("2022-01-01") + pd.to_timedelta(rng.integers(0, 3 * 365, n_rx), unit="D"),
+        "quantity": rng.integers(1, 6, n_rx),
+    })
+    prescriptions.to_csv(os.path.join(out_dir, "prescriptions.csv"), index=False)
+    return {"diagnoses": len(DIAGNOSES), "drugs": len(DRUGS), "visits": rows, "prescriptions": n_rx}
@@ -0,0 +1,127 @@
+import json
+import asyncio
+import hashlib
+from typing import Any, Dict, List, Optional
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.messages import AIMessage, AIMessageChunk, HumanMessage
+from langchain_core.outputs import ChatGeneration, ChatGenerationChunk, ChatResult
+
+# Recorded agent runs: the question and the tool calls the model made, in order
+SCENARIOS: List[Dict[str, Any]] = [
+    {
+        "question": "Сколько пациентов с диабетом по регионам?",
+        "calls": [
+            ("search_codes", {"table": "diagnoses", "keywords": ["диабет"]}),
+            ("execute_sql", {"sql": "SELECT region, count(DISTINCT patient_id) AS patients FROM visits "
+                                    "WHERE diagnosis_code IN ('E10', 'E11') GROUP BY region ORDER BY patients DESC"}),
+            ("final_answer", {"answer": "Больше всего пациентов с диабетом в Москве.", "insights": ["Диабет 2 типа встречается чаще"]}),
+        ],
+    },
+    {
+        "question": "Динамика заболеваемости гипертензией по месяцам",
+        "calls": [
+            ("search_codes", {"table": "diagnoses", "keywords": ["гипертензия", "I10"]}),
+            ("generate_visualization", {
+                "sql": "SELECT date_trunc('month', visit_date) AS month, count(*) AS visits FROM visits "
+                       "WHERE diagnosis_code IN ('I10', 'I11') GROUP BY 1 ORDER BY 1",
+                "python_code": "fig = px.line(df, x='month', y='visits', title='Гипертензия по месяцам')",
+            }),
+            ("final_answer", {"answer": "Число обращений с гипертензией стабильно по месяцам.", "insights": []}),
+        ],
+    },
+    {
+        "question": "Какие препараты назначают чаще всего?",
+        "calls": [
+            ("execute_sql", {"sql": "SELECT d.full_name, sum(p.quantity) AS total FROM prescriptions p "
+                                    "JOIN drugs d USING (drug_code) GROUP BY 1 ORDER BY 2 DESC LIMIT 10"}),
+            ("generate_visualization", {
+                "sql": "SELECT d.full_name, sum(p.quantity) AS total FROM prescriptions p "
+                       "JOIN drugs d USING (drug_code) GROUP BY 1 ORDER BY 2 DESC",
+                "python_code": "fig = px.bar(df, x='full_name', y='total')",
+            }),
+            ("final_answer", {"answer": "Чаще всего назначают метформин.", "insights": ["Топ-3 — препараты от диабета и гипертензии"]}),
+        ],
+    },
+    {
+        "question": "Распределение возраста пациентов с астмой",
+        "calls": [
+            ("search_codes", {"table": "diagnoses", "keywords": ["астма"]}),
+            ("generate_visualization", {
+                "sql": "SELECT age FROM visits WHERE diagnosis_code = 'J45'",
+                "python_code": "fig = px.histogram(df, x='age', nbins=20)",
+            }),
+            ("final_answer", {"answer": "Астма чаще встречается у детей и пожилых.", "insights": []}),
+        ],
+    },
+]
+
+
+def load_scenarios(path: Optional[str]) -> List[Dict[str, Any]]:
+    if not path:
+        return SCENARIOS
+    with open(path, encoding="utf-8") as fh:
+        return [{"question": s["question"], "calls": [tuple(c) for c in s["calls"]]} for s in json.load(fh)]
+
+
+class ScriptedChatModel(BaseChatModel):
+    """
+    Deterministic stand-in for the Groq/OpenRouter models. The scenario is picked
+    by the question of the current turn and the step by how many AI messages
+    followed it, so concurrent conversations replay independently.
+    """
+
+    scenarios: List[Dict[str, Any]] = SCENARIOS
+    latency: float = 0.0        # seconds per call
+    token_delay: float = 0.0    # seconds between streamed chunks
+
+    @property
+    def _llm_type(self) -> str:
+        return "scripted"
+
+    def bind_tools(self, tools, **kwargs):
+        return self
+
+    def _next_message(self, messages) -> AIMessage:
+        question, step = "", 0
+        for m in reversed(messages):
+            if isinstance(m, HumanMessage):
+                question = str(m.content)
+                break
+            if isinstance(m, AIMessage):
+                step += 1
+        by_question = {s["question"]: s for s in self.scenarios}
+        scenario = by_question.get(question) or self.scenarios[
+            int(hashlib.md5(question.encode()).hexdigest(), 16) % len(self.scenarios)]
+        name, args = scenario["calls"][min(step, len(scenario["calls"]) - 1)]
+        tokens_in = sum(len(str(getattr(m, "content", m))) for m in messages) // 3
+        return AIMessage(
+            content="",
+            tool_calls=[{"name": name, "args": args, "id": f"call_{step}_{hashlib.md5(question.encode()).hexdigest()[:8]}",
+                         "type": "tool_call"}],
+            usage_metadata={"input_tokens": tokens_in, "output_tokens": len(json.dumps(args)) // 3,
+                            "total_tokens": tokens_in + len(json.dumps(args)) // 3},
+        )
+
+    def _generate(self, messages, stop=None, run_manager=None, **kwargs) -> ChatResult:
+        return ChatResult(generations=[ChatGeneration(message=self._next_message(messages))])
+
+    async def _agenerate(self, messages, stop=None, run_manager=None, **kwargs) -> ChatResult:
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        return self._generate(messages, stop, **kwargs)
+
+    async def _astream(self, messages, stop=None, run_manager=None, **kwargs):
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        msg = self._next_message(messages)
+        tc = msg.tool_calls[0]
+        args = json.dumps(tc["args"], ensure_ascii=False)
+        pieces = [args[i:i + 16] for i in range(0, len(args), 16)] or [""]
+        for i, piece in enumerate(pieces):
+            chunk = AIMessageChunk(content="", tool_call_chunks=[{
+                "name": tc["name"] if i == 0 else None, "args": piece,
+                "id": tc["id"] if i == 0 else None, "index": 0,
+            }], usage_metadata=msg.usage_metadata if i == len(pieces) - 1 else None)
+            yield ChatGenerationChunk(message=chunk)
+            if self.token_delay:
+                await asyncio.sleep(self.token_delay)
@@ -0,0 +1,194 @@
+"""
+Offline end-to-end benchmark: synthetic data, scripted LLM, concurrent SSE clients.
+
+    python -m bench.run --rows 200000 --clients 8 --requests 64
+"""
+import os
+import sys
+import json
+import time
+import asyncio
+import argparse
+import resource
+import tempfile
+from collections import defaultdict
+from typing import Any, Dict, List
+
+import numpy as np
+
+
+def _percentiles(values: List[float]) -> Dict[str, float]:
+    arr = np.asarray(values)
+    return {"n": len(arr), "p50": float(np.percentile(arr, 50)), "p95": float(np.percentile(arr, 95)),
+            "p99": float(np.percentile(arr, 99)), "max": float(arr.max())}
+
+
+def _peak_rss_mb() -> Dict[str, float]:
+    # ru_maxrss is in KiB on Linux; children covers the visualization workers
+    return {
+        "server": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+        "workers": resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss / 1024,
+    }
+
+
+async def _post_sse(app, path: str, body: Dict[str, Any]):
+    """POST to the ASGI app in-process and yield SSE lines as they are sent (httpx's ASGITransport buffers)."""
+    payload = json.dumps(body).encode()
+    scope = {
+        "type": "http", "asgi": {"version": "3.0"}, "http_version": "1.1", "method": "POST",
+        "scheme": "http", "path": path, "raw_path": path.encode(), "query_string": b"", "root_path": "",
+        "headers": [(b"content-type", b"application/json"), (b"content-length", str(len(payload)).encode())],
+        "client": ("bench", 0), "server": ("bench", 80),
+    }
+    chunks: asyncio.Queue = asyncio.Queue()
+    received = False
+
+    async def receive():
+        nonlocal received
+        if not received:
+            received = True
+            return {"type": "http.request", "body": payload, "more_body": False}
+        await asyncio.Event().wait()  # the client never disconnects
+
+    async def send(message):
+        if message["type"] == "http.response.body":
+            await chunks.put(message.get("body", b""))
+            if not message.get("more_body"):
+                await chunks.put(None)
+
+    task = asyncio.create_task(app(scope, receive, send))
+    task.add_done_callback(lambda _: chunks.put_nowait(None))
+    buffer = ""
+    while (chunk := await chunks.get()) is not None:
+        buffer += chunk.decode()
+        *lines, buffer = buffer.split("\n")
+        for line in lines:
+            yield line
+    await task
+
+
+async def _client(app, questions: List[str], queue: asyncio.Queue, args, results: Dict[str, List[float]], errors: list):
+    while True:
+        try:
+            i = queue.get_nowait()
+        except asyncio.QueueEmpty:
+            return
+        body = {"query": questions[i % len(questions)], "no_cache": not args.cache, "stream_tokens": not args.no_stream}
+        t0 = time.perf_counter()
+        first = None
+        async for line in _post_sse(app, "/chat/stream", body):
+            if not line.startswith("data: "):
+                continue
+            if first is None:
+                first = time.perf_counter() - t0
+            event = json.loads(line[6:])
+            if event["type"] == "error":
+                errors.append(event["message"])
+            for span in event.get("spans", []):
+                label = span.get("tool") or span.get("source") or span.get("model")
+                key = span["stage"] + (f":{label}" if label else "")
+                results[key].append(span["ms"] / 1000)
+        results["request"].append(time.perf_counter() - t0)
+        if first is not None:
+            results["first_event"].append(first)
+
+
+async def _run(args, app, scenarios) -> Dict[str, Any]:
+    questions = [s["question"] for s in scenarios]
+    results: Dict[str, List[float]] = defaultdict(list)
+    errors: list = []
+    # Warm-up: first chart, first plan of each query shape
+    warm: asyncio.Queue = asyncio.Queue()
+    for i in range(len(questions)):
+        warm.put_nowait(i)
+    await _client(app, questions, warm, args, defaultdict(list), [])
+
+    queue: asyncio.Queue = asyncio.Queue()
+    for i in range(args.requests):
+        queue.put_nowait(i)
+    t0 = time.perf_counter()
+    await asyncio.gather(*[_client(app, questions, queue, args, results, errors) for _ in range(args.clients)])
+    wall = time.perf_counter() - t0
+
+    return {
+        "requests": args.requests, "clients": args.clients, "wall_seconds": wall,
+        "throughput_rps": args.requests / wall, "errors": len(errors), "error_samples": errors[:3],
+        "stages": {k: _percentiles(v) for k, v in sorted(results.items())},
+    }
+
+
+def _print_report(report: Dict[str, Any]):
+    print(f"\nrows={report['rows']}  startup={report['startup_seconds']:.2f}s  "
+          f"clients={report['clients']}  requests={report['requests']}  errors={report['errors']}")
+    print(f"wall={report['wall_seconds']:.2f}s  throughput={report['throughput_rps']:.2f} req/s  "
+          f"peak RSS server={report['peak_rss_mb']['server']:.0f}MB workers={report['peak_rss_mb']['workers']:.0f}MB\n")
+    print(f"{'stage':<36}{'n':>6}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'max ms':>10}")
+    for stage, p in report["stages"].items():
+        print(f"{stage:<36}{p['n']:>6}{p['p50'] * 1000:>10.1f}{p['p95'] * 1000:>10.1f}"
+              f"{p['p99'] * 1000:>10.1f}{p['max'] * 1000:>10.1f}")
+    for err in report["error_samples"]:
+        print(f"error: {err[:200]}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type=int, default=100_000, help="rows in the visits fact table")
+    parser.add_argument("--data-dir", help="use/keep generated CSVs here instead of a temp dir")
+    parser.add_argument("--clients", type=int, default=4, help="concurrent SSE clients")
+    parser.add_argument("--requests", type=int, default=32, help="total requests after warm-up")
+    parser.add_argument("--scenarios", help="JSON file with recorded [{question, calls: [[tool, args], ...]}]")
+    parser.add_argument("--llm-latency", type=float, default=0.0, help="simulated ms per LLM call")
+    parser.add_argument("--token-delay", type=float, default=0.0, help="simulated ms between streamed chunks")
+    parser.add_argument("--cache", action="store_true", help="allow answer-cache hits")
+    parser.add_argument("--no-sql-cache", action="store_true", help="disable the SQL result cache")
+    parser.add_argument("--no-stream", action="store_true", help="disable token delta events")
+    parser.add_argument("--json", help="also write the report to this file")
+    args = parser.parse_args(argv)
+
+    from bench.datagen import generate
+    from bench.fake_llm import ScriptedChatModel, load_scenarios
+
+    tmp = None
+    data_dir = args.data_dir
+    if not data_dir:
+        tmp = tempfile.TemporaryDirectory(prefix="medinsight-bench-")
+        data_dir = tmp.name
+    if not os.path.exists(os.path.join(data_dir, "visits.csv")):
+        t0 = time.perf_counter()
+        generate(data_dir, rows=args.rows)
+        print(f"Generated data in {time.perf_counter() - t0:.1f}s -> {data_dir}", file=sys.stderr)
+
+    # Config is read at import time, so the environment must be set first
+    os.environ.update(DATA_DIR=data_dir, CHECKPOINT_BACKEND="memory")
+    if args.no_sql_cache:
+        os.environ["SQL_CACHE_MB"] = "0"
+    os.environ.setdefault("GROQ_API_KEY", "bench")
+    os.environ.setdefault("OPENROUTER_API_KEY", "bench")
+
+    scenarios = load_scenarios(args.scenarios)
+    t0 = time.perf_counter()
+    from backend.api import app
+    from backend.graph import medical_graph
+    # Models are set before start() so the real provider clients are never built
+    model = ScriptedChatModel(scenarios=scenarios, latency=args.llm_latency / 1000, token_delay=args.token_delay / 1000)
+    medical_graph.primary = model
+    medical_graph.fallback = model
+    # The in-process driver does not run the ASGI lifespan; load synchronously instead
+    medical_graph.start()
+    startup = time.perf_counter() - t0
+
+    try:
+        report = asyncio.run(_run(args, app, scenarios))
+    finally:
+        medical_graph.sandbox.close()
+        if tmp:
+            tmp.cleanup()
+    report.update(rows=args.rows, startup_seconds=startup, peak_rss_mb=_peak_rss_mb())
+    _print_report(report)
+    if args.json:
+        with open(args.json, "w") as fh:
+            json.dump(report, fh, indent=2)
+
+
+if __name__ == "__main__":
+    main()
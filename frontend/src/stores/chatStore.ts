@@ -194,7 +194,7 @@ export const useChatStore = create<ChatState>((set, get) => ({
   },
 
   sendMessage: async (text: string) => {
-    const { currentChatId, createChat, addMessage, setLoading, getChatById, setThreadId } = get();
+    const { currentChatId, createChat, addMessage, updateMessage, setLoading, getChatById, setThreadId } = get();
 
     let chatId = currentChatId;
     if (!chatId) {
@@ -219,18 +219,23 @@ export const useChatStore = create<ChatState>((set, get) => ({
       if (!reader) throw new Error('No reader');
 
       const decoder = new TextDecoder();
+      let buffer = '';
       let finalAnswer = '';
       let lastThought = '';
       let plotlyData: any = null;
       let threadId: string | null = null;
+      let streamedAnswer = '';
+      let agentMessageId: string | null = null;
 
       while (true) {
         const { done, value } = await reader.read();
         if (done) break;
 
-        const chunk = decoder.decode(value, { stream: true });
-        const lines = chunk.split('\n');
-        
+        // SSE lines (e.g. large charts) may span several chunks
+        buffer += decoder.decode(value, { stream: true });
+        const lines = buffer.split('\n');
+        buffer = lines.pop() ?? '';
+
         for (const line of lines) {
           if (!line.startsWith('data: ')) continue;
           
@@ -241,15 +246,32 @@ export const useChatStore = create<ChatState>((set, get) => ({
               plotlyData = data.data;
             }
             
+            if (data.type === 'delta') {
+              if (data.kind === 'answer') {
+                streamedAnswer += data.text;
+                if (agentMessageId) {
+                  updateMessage(chatId!, agentMessageId, { text: streamedAnswer });
+                } else {
+                  agentMessageId = addMessage(chatId!, { role: 'agent', text: streamedAnswer, plotlyData });
+                }
+              } else if (data.kind === 'reset') {
+                // The primary model failed mid-answer; the fallback streams from the start
+                streamedAnswer = '';
+                lastThought = '';
+                if (agentMessageId) {
+                  updateMessage(chatId!, agentMessageId, { text: '' });
+                }
+              } else {
+                lastThought += data.text;
+              }
+            }
+
             if (data.type === 'step' && data.thought) {
               lastThought = data.thought;
             }
             
             if (data.type === 'final') {
               finalAnswer = extractAnswer(data.answer);
-              if (data.visualization) {
-                plotlyData = data.visualization;
-              }
               if (data.thread_id) {
                 threadId = data.thread_id;
               }
@@ -266,8 +288,12 @@ export const useChatStore = create<ChatState>((set, get) => ({
         setThreadId(chatId!, threadId);
       }
 
-      const displayText = finalAnswer || lastThought || 'Ответ получен';
-      addMessage(chatId!, { role: 'agent', text: displayText, plotlyData });
+      const displayText = finalAnswer || streamedAnswer || lastThought || 'Ответ получен';
+      if (agentMessageId) {
+        updateMessage(chatId!, agentMessageId, { text: displayText, plotlyData });
+      } else {
+        addMessage(chatId!, { role: 'agent', text: displayText, plotlyData });
+      }
 
     } catch (error) {
       addMessage(chatId!, { role: 'agent', text: `Ошибка подключения: ${error}` });
@@ -0,0 +1,76 @@
+import duckdb
+import pytest
+
+from backend.config import cfg
+from backend.rollups import RollupRouter, build_rollup, read_rollups
+
+QUERIES = [
+    "SELECT region, count(*) AS n FROM visits GROUP BY region ORDER BY region",
+    "SELECT count(*) AS n FROM visits",
+    "SELECT count(*) AS n FROM visits WHERE region = 'Nowhere'",
+    "SELECT region, count(*) AS n FROM visits WHERE gender = 'F' GROUP BY ALL ORDER BY 1",
+    "SELECT region, count(*) AS n FROM visits GROUP BY region HAVING count(*) > 300 ORDER BY region",
+    "SELECT date_trunc('month', visit_date) AS m, count(*) AS n FROM visits GROUP BY 1 ORDER BY 1",
+]
+
+
+@pytest.fixture
+def conn(monkeypatch):
+    monkeypatch.setattr(cfg, "ROLLUP_MIN_ROWS", 1000)
+    conn = duckdb.connect()
+    conn.execute("""
+        CREATE TABLE visits AS
+        SELECT i AS patient_id,
+               ['Москва', 'Казань', 'Омск'][1 + i % 3] AS region,
+               CASE WHEN i % 5 = 0 THEN 'M' ELSE 'F' END AS gender,
+               DATE '2022-01-01' + (i % 365)::INT AS visit_date
+        FROM range(5000) t(i)
+    """)
+    assert build_rollup(conn, "visits") is not None
+    yield conn
+    conn.close()
+
+
+@pytest.mark.parametrize("sql", QUERIES)
+def test_rewrite_matches_source(conn, sql):
+    rewrite = RollupRouter(read_rollups(conn)).rewrite(sql)
+    assert rewrite is not None, "query should be served from the rollup"
+    rewritten, _ = rewrite
+    assert conn.execute(rewritten).fetchall() == conn.execute(sql).fetchall()
+
+
+@pytest.mark.parametrize("sql", [
+    "SELECT count(*) FROM visits WHERE visit_date = DATE '2022-03-01'",
+    "SELECT count(DISTINCT patient_id) FROM visits",
+    "SELECT patient_id, count(*) FROM visits GROUP BY 1",
+])
+def test_unsupported_shapes_are_not_rewritten(conn, sql):
+    assert RollupRouter(read_rollups(conn)).rewrite(sql) is None
+
+
+def _write_visits(path, rows):
+    duckdb.sql(f"""
+        COPY (SELECT i AS patient_id, ['Москва', 'Казань', 'Омск'][1 + i % 3] AS region FROM range({rows}) t(i))
+        TO '{path}' (HEADER)
+    """)
+
+
+def test_disabled_rollups_do_not_serve_stale_counts(tmp_path, monkeypatch):
+    from backend.database import Database
+
+    monkeypatch.setattr(cfg, "ROLLUP_MIN_ROWS", 1000)
+    data, store = tmp_path / "data", str(tmp_path / "store.duckdb")
+    data.mkdir()
+    _write_visits(data / "visits.csv", 5000)
+    db = Database(str(data), db_path=store)
+    assert db.rollups.rollups and db.execute("SELECT count(*) AS n FROM visits")[0].n[0] == 5000
+    db.pool.close()
+    db.conn.close()
+
+    # Restart with rollups off after the source changed
+    monkeypatch.setattr(cfg, "ROLLUPS", False)
+    _write_visits(data / "visits.csv", 1000)
+    db = Database(str(data), db_path=store)
+    assert not db.rollups.rollups
+    assert db.execute("SELECT count(*) AS n FROM visits")[0].n[0] == 1000
+    assert not db.fetchall("SELECT * FROM duckdb_tables() WHERE table_name = 'rollup_visits'")